@@ -20,6 +20,7 @@ import shutil
 from clade.utils import get_logger, merge_preset_to_conf
 from clade.intercept import intercept
 from clade.extensions.abstract import Extension
+from clade.extensions.cmd_graph import CmdGraphIndex
 from clade.extensions.utils import nested_dict, traverse
 
 
@@ -60,6 +61,7 @@ class Clade:
         self.__prepare_to_init()
 
         self._cmd_graph = None
+        self._cmd_graph_index = None
         self._src_graph = None
         self._src_info = None
         self._pid_graph = None
@@ -211,9 +213,17 @@ class Clade:
 
             if ext_obj.is_parsed():
                 ext_obj.check_conf_consistency()
-            else:
+
+            # Commands intercepted with append=True after the previous
+            # parse are parsed as well
+            if not ext_obj.is_parsed() or ext_obj.is_outdated(self.cmds_file):
+                # Extensions expect that files in the Storage are not packed
+                self.Storage.unpack()
                 ext_obj.parse(self.cmds_file)
 
+        if self.conf.get("Storage.pack"):
+            self.Storage.pack()
+
         return [e for e in ext_objs if e.name in ext_names]
 
     def __get_ext_obj_list(self, ext_names):
@@ -291,6 +301,14 @@ class Clade:
 
         return self._cmd_graph
 
+    @property
+    def cmd_graph_index(self):
+        """Index for queries about (indirect) relations between commands in the command graph."""
+        if not self._cmd_graph_index:
+            self._cmd_graph_index = CmdGraphIndex(self.cmd_graph)
+
+        return self._cmd_graph_index
+
     @property
     def cmd_ids(self):
         """List of identifiers of all parsed commands."""
@@ -391,34 +409,17 @@ class Clade:
 
     def get_root_cmds(self, cmd_id):
         """Get list of identifiers of all root commands from a command graph of a given command identifier."""
-        if cmd_id not in self.cmd_graph:
-            raise RuntimeError("Can't find {!r} id in the command graph".format(cmd_id))
-
-        using = self.cmd_graph[cmd_id]["using"]
-
-        indirect_using = []
-        for using_id in using:
-            indirect_using.extend(self.get_root_cmds(using_id))
-
-        using.extend(indirect_using)
-        return using
+        return self.cmd_graph_index.get_ancestors(cmd_id)
 
     def get_root_cmds_by_type(self, cmd_id, cmd_type):
-        return [x for x in self.get_root_cmds(cmd_id) if self.get_cmd_type(x) == cmd_type]
+        return self.cmd_graph_index.get_ancestors(cmd_id, cmd_type)
 
     def get_leaf_cmds(self, cmd_id):
         """Get list of identifiers of all leaf commands from a command graph of a given command identifier."""
-        if cmd_id not in self.cmd_graph:
-            raise RuntimeError("Can't find {!r} id in the command graph".format(cmd_id))
-
-        used_by = self.cmd_graph[cmd_id]["used_by"]
+        return self.cmd_graph_index.get_descendants(cmd_id)
 
-        indirect_used_by = []
-        for used_by_id in used_by:
-            indirect_used_by.extend(self.get_leaf_cmds(used_by_id))
-
-        used_by.extend(indirect_used_by)
-        return used_by
+    def get_leaf_cmds_by_type(self, cmd_id, cmd_type):
+        return self.cmd_graph_index.get_descendants(cmd_id, cmd_type)
 
     @property
     def SrcGraph(self):
@@ -519,6 +520,46 @@ class Clade:
         """
 
         self.Storage.add_file(file, storage_filename=storage_filename, encoding=encoding)
+        self.Storage.flush_data_by_key()
+
+    def add_files_to_storage(self, files, encoding=None):
+        """Add several files to the storage.
+
+        Args:
+            files: List of paths to the files
+            encoding: encoding of the files, like in add_file_to_storage()
+        """
+
+        self.Storage.add_files(files, encoding=encoding)
+        self.Storage.flush_data_by_key()
+
+    def open_storage_file(self, path, mode="r", encoding=None, errors=None):
+        """Open file from the Storage for reading, even if the Storage is packed.
+
+        Args:
+            path: A path to the file, like in get_storage_path()
+            mode: "r" to read text or "rb" to read bytes
+            encoding: Encoding of the file, like in open()
+            errors: How encoding errors are handled, like in open()
+
+        Returns:
+            A file object
+        """
+        return self.Storage.open_file(path, mode=mode, encoding=encoding, errors=errors)
+
+    def read_storage_file(self, path, mode="r", encoding=None, errors=None):
+        """Read content of the file from the Storage, even if the Storage is packed.
+
+        Args:
+            path: A path to the file, like in get_storage_path()
+            mode: "r" to read text or "rb" to read bytes
+            encoding: Encoding of the file, like in open()
+            errors: How encoding errors are handled, like in open()
+
+        Returns:
+            A string, or bytes in "rb" mode
+        """
+        return self.Storage.read_file(path, mode=mode, encoding=encoding, errors=errors)
 
     def get_storage_path(self, path):
         """Get path to the file or directory from the storage."""
@@ -16,10 +16,19 @@
 import abc
 import os
 import shlex
+import shutil
+import struct
 import subprocess
 import tempfile
 
-from clade.cmds import get_last_id
+from clade.cmds import (
+    get_last_id,
+    get_cmds_index,
+    remove_cmds_index,
+    merge_spool_files,
+    is_binary_cmds_file,
+    DEPS_SUFFIX,
+)
 from clade.utils import get_logger
 from clade.server import PreprocessServer
 
@@ -46,11 +55,22 @@ class Intercept(metaclass=abc.ABCMeta):
         self.append = append
         self.conf = conf if conf else dict()
         self.logger = get_logger("Intercept", self.conf)
+        self.spool_dir = None
+        self.last_used_id = "0"
         self.env = self._setup_env()
 
         if not self.append and os.path.exists(self.output):
             os.remove(self.output)
 
+        if not self.append:
+            remove_cmds_index(self.output)
+
+        # Dependencies written during previous builds may be outdated, and they can be kept
+        # only if new commands are appended and their dependencies are written as well
+        intercept_deps = self.conf.get("Intercept.preprocess") and self.conf.get("CC.intercept_deps")
+        if not self.append or not intercept_deps:
+            shutil.rmtree(self.output + DEPS_SUFFIX, ignore_errors=True)
+
     def _setup_env(self):
         env = dict(os.environ)
 
@@ -59,12 +79,33 @@ class Intercept(metaclass=abc.ABCMeta):
 
         # Prepare environment variables for PID graph
         if self.append:
-            last_used_id = get_last_id(self.output)
-        else:
-            last_used_id = "0"
+            self.last_used_id = get_last_id(self.output)
 
         f = tempfile.NamedTemporaryFile(delete=False)
-        f.write(last_used_id.encode())
+
+        binary = self.conf.get("Intercept.binary")
+
+        # New commands must be stored in the same format as the existing ones
+        if self.append and os.path.isfile(self.output) and os.path.getsize(self.output):
+            binary = is_binary_cmds_file(self.output)
+
+        if binary and self.conf.get("Intercept.preprocess"):
+            raise RuntimeError("Binary format of intercepted commands is not supported in preprocess mode")
+        elif binary:
+            self.logger.debug("Set 'CLADE_BINARY' environment variable value")
+            env["CLADE_BINARY"] = "true"
+
+        # Preprocess server requires commands to be sent in the order of their ids
+        if self.conf.get("Intercept.spool") and not self.conf.get("Intercept.preprocess") and not binary:
+            self.spool_dir = tempfile.mkdtemp()
+            self.logger.debug("Set 'CLADE_SPOOL_DIR' environment variable value")
+            env["CLADE_SPOOL_DIR"] = self.spool_dir
+
+            # Counter of ids is incremented by intercepted processes without locks
+            f.write(struct.pack("q", int(self.last_used_id)))
+        else:
+            f.write(self.last_used_id.encode())
+
         env["CLADE_ID_FILE"] = f.name
         env["CLADE_PARENT_ID"] = "0"
 
@@ -108,4 +149,22 @@ class Intercept(metaclass=abc.ABCMeta):
 
         shell_command = " ".join([shlex.quote(x) for x in self.command])
         self.logger.debug("Execute {!r} command".format(shell_command))
-        return subprocess.call(shell_command, env=self.env, shell=True, cwd=self.cwd)
+        ret = subprocess.call(shell_command, env=self.env, shell=True, cwd=self.cwd)
+
+        if self.spool_dir:
+            self.merge_spool_files()
+
+        self.build_cmds_index()
+        return ret
+
+    def merge_spool_files(self):
+        """Merge commands intercepted in spool mode into the file with commands."""
+        self.logger.debug("Merge spool files from {!r}".format(self.spool_dir))
+        merge_spool_files(self.spool_dir, self.output, self.last_used_id)
+        shutil.rmtree(self.spool_dir)
+
+    def build_cmds_index(self):
+        """Build index of intercepted commands, so they can be parsed faster."""
+        if os.path.isfile(self.output) and os.path.getsize(self.output):
+            self.logger.debug("Build index of intercepted commands")
+            get_cmds_index(self.output)
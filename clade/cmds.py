@@ -13,13 +13,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import array
+import bisect
+import hashlib
+import itertools
 import os
 import re
+import struct
+import tempfile
+import ujson
+
 DELIMITER = "||"
+INDEX_SUFFIX = ".idx"
+# Directory with dependencies written by compilers during the build
+DEPS_SUFFIX = ".deps"
+
+# Number of bytes at the end of the indexed part of the file
+# that are used to check that the file was appended, not replaced
+INDEX_TAIL_SIZE = 4096
+
+# Each record in the binary file with intercepted commands starts with a header:
+# magic, size of the record, id, parent id, pid, timestamp in nanoseconds and
+# hash of the environment. Header is followed by null-terminated strings:
+# cwd, which and command arguments. Records are written by the libinterceptor.
+BINARY_MAGIC = b"\0CLD"
+BINARY_HEADER = struct.Struct("=4sIIIIQQ")
+BINARY_CHUNK_SIZE = 1 << 20
 
 
 def open_cmds_file(cmds_file):
-    """Open txt file with intercepted commands and return file object.
+    """Open file with intercepted commands and return file object.
+
+    Binary file is opened in binary mode, txt file is opened in text mode.
 
     Raises:
         RuntimeError: Specified file does not exist or empty.
@@ -29,48 +54,459 @@ def open_cmds_file(cmds_file):
     if not os.path.getsize(cmds_file):
         raise RuntimeError("Specified {} file is empty".format(cmds_file))
 
+    if is_binary_cmds_file(cmds_file):
+        return open(cmds_file, "rb")
+
     return open(cmds_file)
 
 
-def iter_cmds_by_which(cmds_file, which_list):
+def is_binary_cmds_file(cmds_file):
+    """Check that file with intercepted commands has binary format."""
+    with open(cmds_file, "rb") as cmds_fp:
+        return cmds_fp.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def iter_binary_records(cmds_fp):
+    """Get an iterator over records of the binary file with intercepted commands.
+
+    Iterator starts from the current position in the file and yields
+    header and the rest of each record. Last record is skipped
+    if it is not completely written.
+    """
+    unpack_header = BINARY_HEADER.unpack_from
+    header_size = BINARY_HEADER.size
+
+    data = b""
+    pos = 0
+
+    # Small chunk is read first, since often only a single command is needed
+    chunk_size = 4096
+
+    while True:
+        chunk = cmds_fp.read(chunk_size)
+        chunk_size = min(2 * chunk_size, BINARY_CHUNK_SIZE)
+
+        if not chunk:
+            return
+
+        data = data[pos:] + chunk
+        pos = 0
+        end = header_size
+
+        while end <= len(data):
+            header = unpack_header(data, pos)
+            end = pos + header[1]
+
+            if end > len(data):
+                break
+
+            if header[0] != BINARY_MAGIC:
+                raise RuntimeError("Binary file with intercepted commands is corrupted")
+
+            yield header, data[pos + header_size:end]
+
+            pos = end
+            end = pos + header_size
+
+
+def iter_raw_cmds(cmds_fp):
+    """Get an iterator over lines of the txt file or records of the binary file."""
+    if "b" in cmds_fp.mode:
+        return iter_binary_records(cmds_fp)
+
+    return cmds_fp
+
+
+def split_raw_cmd(raw_cmd):
+    """Convert a line of the txt file or a record of the binary file into dictionary."""
+    if isinstance(raw_cmd, str):
+        return split_cmd(raw_cmd)
+
+    return split_binary_cmd(raw_cmd)
+
+
+class CmdsIndex:
+    """Index of the txt file with intercepted commands.
+
+    Index contains an offset of each command in the file and a 'which'
+    field of each command, which allows to get commands by id or by
+    'which' field without reading the whole file. It is stored next to
+    the file with commands (cmds.txt.idx) and extended when new commands
+    are appended to the file.
+
+    Attributes:
+        cmds_file: Path to the txt file with intercepted commands.
+        size: Size of the indexed part of the file.
+        inode: Inode of the indexed file.
+        tail_hash: Hash of the last bytes of the indexed part of the file.
+        offsets: Array with offset of each command (command id - 1 is its index).
+        which: List of all unique 'which' values.
+        which_ids: Array with index in 'which' list for each command.
+    """
+
+    def __init__(self, cmds_file):
+        self.cmds_file = cmds_file
+        self.index_file = cmds_file + INDEX_SUFFIX
+        self.__reset()
+
+    def __reset(self):
+        self.size = 0
+        self.mtime = None
+        self.inode = None
+        self.tail_hash = None
+        self.offsets = array.array("Q")
+        self.which = []
+        self.which_ids = array.array("I")
+        self.__which_map = dict()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def update(self):
+        """Index commands that were added to the file since the last update.
+
+        Returns:
+            True if index was changed, False otherwise.
+        """
+        st = os.stat(self.cmds_file)
+
+        if (
+            st.st_size == self.size
+            and st.st_mtime_ns == self.mtime
+            and st.st_ino == self.inode
+        ):
+            return False
+
+        # File was overwritten, not appended
+        if (
+            st.st_size < self.size
+            or st.st_ino != self.inode
+            or self.__get_tail_hash() != self.tail_hash
+        ):
+            self.__reset()
+
+        # Last line without a newline character could be
+        # not completely written at the moment of the previous update
+        while self.offsets and self.offsets[-1] >= self.size:
+            self.offsets.pop()
+            self.which_ids.pop()
+
+        try:
+            self.__update_index()
+        except RuntimeError:
+            if not self.size:
+                raise
+
+            # Indexed part of the file was changed in some other way,
+            # so the file is indexed from scratch
+            self.__reset()
+            self.__update_index()
+
+        self.mtime = st.st_mtime_ns
+        self.inode = st.st_ino
+        self.tail_hash = self.__get_tail_hash()
+        return True
+
+    def __update_index(self):
+        if is_binary_cmds_file(self.cmds_file):
+            self.__update_binary()
+        else:
+            self.__update_txt()
+
+    def __get_tail_hash(self):
+        if not self.size:
+            return None
+
+        with open(self.cmds_file, "rb") as cmds_fp:
+            cmds_fp.seek(max(self.size - INDEX_TAIL_SIZE, 0))
+            tail = cmds_fp.read(min(self.size, INDEX_TAIL_SIZE))
+
+        return hashlib.md5(tail).hexdigest()
+
+    def __update_binary(self):
+        with open(self.cmds_file, "rb") as cmds_fp:
+            cmds_fp.seek(self.size)
+
+            offset = self.size
+            for header, data in iter_binary_records(cmds_fp):
+                which = data.split(b"\0", 2)[1].decode("utf-8", "replace")
+
+                if which not in self.__which_map:
+                    self.__which_map[which] = len(self.which)
+                    self.which.append(which)
+
+                self.offsets.append(offset)
+                self.which_ids.append(self.__which_map[which])
+
+                offset += header[1]
+
+        self.size = offset
+
+    def __update_txt(self):
+        with open(self.cmds_file, "rb") as cmds_fp:
+            cmds_fp.seek(self.size)
+
+            offset = self.size
+            for line in cmds_fp:
+                try:
+                    which = line.split(DELIMITER.encode(), 3)[2].decode("utf-8", "replace")
+                except IndexError:
+                    # Last line is not completely written yet
+                    if not line.endswith(b"\n"):
+                        break
+
+                    raise RuntimeError("File with intercepted commands is corrupted")
+
+                if which not in self.__which_map:
+                    self.__which_map[which] = len(self.which)
+                    self.which.append(which)
+
+                self.offsets.append(offset)
+                self.which_ids.append(self.__which_map[which])
+
+                if line.endswith(b"\n"):
+                    offset += len(line)
+
+        self.size = offset
+
+    def load(self):
+        """Load index from the index file, if it exists."""
+        try:
+            with open(self.index_file, "rb") as index_fp:
+                header = ujson.loads(index_fp.readline())
+
+                offsets = array.array("Q")
+                offsets.fromfile(index_fp, header["number"])
+                which_ids = array.array("I")
+                which_ids.fromfile(index_fp, header["number"])
+        except (OSError, EOFError, ValueError, KeyError):
+            return False
+
+        self.size = header["size"]
+        self.mtime = header["mtime"]
+        self.inode = header.get("inode")
+        self.tail_hash = header.get("tail_hash")
+        self.offsets = offsets
+        self.which = header["which"]
+        self.which_ids = which_ids
+        self.__which_map = {which: i for i, which in enumerate(self.which)}
+        return True
+
+    def dump(self):
+        """Save index to the index file."""
+        header = {
+            "size": self.size,
+            "mtime": self.mtime,
+            "inode": self.inode,
+            "tail_hash": self.tail_hash,
+            "number": len(self.offsets),
+            "which": self.which,
+        }
+
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(self.index_file))
+        except OSError:
+            # Index will be rebuilt each time in case of read-only directory
+            return
+
+        with os.fdopen(fd, "wb") as index_fp:
+            index_fp.write(ujson.dumps(header).encode("utf-8") + b"\n")
+            self.offsets.tofile(index_fp)
+            self.which_ids.tofile(index_fp)
+
+        os.replace(tmp_file, self.index_file)
+
+    def get_which_ids(self, which_list):
+        """Get indexes of all 'which' values that match any regex from the list."""
+        return set(
+            i for i, which in enumerate(self.which)
+            if any(re.search(w, which) for w in which_list)
+        )
+
+    def get_stats(self):
+        """Get number of commands for each 'which' value."""
+        stats = [0] * len(self.which)
+
+        for which_id in self.which_ids:
+            stats[which_id] += 1
+
+        return dict(zip(self.which, stats))
+
+
+__indexes = dict()
+
+
+def get_cmds_index(cmds_file):
+    """Get up-to-date index of the txt file with intercepted commands.
+
+    Raises:
+        RuntimeError: Specified file does not exist or empty.
+    """
+    open_cmds_file(cmds_file).close()
+
+    cmds_file = os.path.abspath(cmds_file)
+    index = __indexes.get(cmds_file)
+
+    if not index:
+        index = CmdsIndex(cmds_file)
+        index.load()
+        __indexes[cmds_file] = index
+
+    if index.update():
+        index.dump()
+
+    return index
+
+
+def remove_cmds_index(cmds_file):
+    """Remove index of the txt file with intercepted commands."""
+    cmds_file = os.path.abspath(cmds_file)
+    __indexes.pop(cmds_file, None)
+
+    try:
+        os.remove(cmds_file + INDEX_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def merge_spool_files(spool_dir, cmds_file, last_id=0):
+    """Append commands from spool files to the txt file in the order of their ids.
+
+    In spool mode each intercepted process writes its commands to a separate
+    file, and each line is prefixed by the command id. Ids of lost commands
+    (for instance, if the process was killed in the middle of writing)
+    are skipped, and ids of the remaining commands are shifted, so the
+    line number of each command in cmds_file is still its id.
+
+    Args:
+        spool_dir: Path to the directory with spool files.
+        cmds_file: Path to the txt file with intercepted commands.
+        last_id: Last id used in cmds_file before interception.
+    """
+    last_id = int(last_id)
+    lines = []
+
+    for spool_file in os.listdir(spool_dir):
+        with open(os.path.join(spool_dir, spool_file), "r") as spool_fp:
+            for line in spool_fp:
+                if not line.endswith("\n"):
+                    continue
+
+                cmd_id, line = line.split(" ", 1)
+                cmd_id = int(cmd_id) - last_id - 1
+
+                if cmd_id >= len(lines):
+                    lines.extend([None] * (cmd_id - len(lines) + 1))
+
+                lines[cmd_id] = line
+
+    lost_ids = [i + last_id + 1 for i, line in enumerate(lines) if line is None]
+
+    with open(cmds_file, "a") as cmds_fp:
+        for line in lines:
+            if line is None:
+                continue
+
+            if lost_ids:
+                cwd, parent_id, rest = line.split(DELIMITER, 2)
+                parent_id = int(parent_id)
+                lost = bisect.bisect_left(lost_ids, parent_id)
+
+                if lost < len(lost_ids) and lost_ids[lost] == parent_id:
+                    parent_id = 0
+                else:
+                    parent_id -= lost
+
+                line = DELIMITER.join([cwd, str(parent_id), rest])
+
+            cmds_fp.write(line)
+
+
+def iter_cmds_by_which(cmds_file, which_list, after_id=0):
     """Get an iterator over all intercepted commands filtered by 'which' field.
 
     Args:
         cmds_file: Path to the txt file with intercepted commands.
         which_list: A list of strings to filter command by 'which' field.
+        after_id: Skip commands with id less or equal to the specified one.
     """
-    for cmd in iter_cmds(cmds_file):
-        for which in which_list:
-            if re.search(which, cmd["which"]):
+    index = get_cmds_index(cmds_file)
+    which_ids = index.get_which_ids(which_list)
+    after_id = int(after_id)
+
+    if after_id >= len(index):
+        return
+
+    # Reading the file sequentially is faster than seeking to each command,
+    # but only matched commands are split
+    with open_cmds_file(cmds_file) as cmds_fp:
+        cmds_fp.seek(index.offsets[after_id])
+
+        raw_cmds = itertools.islice(iter_raw_cmds(cmds_fp), len(index) - after_id)
+        for cmd_id, raw_cmd in enumerate(raw_cmds, start=after_id):
+            if index.which_ids[cmd_id] in which_ids:
+                cmd = split_raw_cmd(raw_cmd)
+                cmd["id"] = str(cmd_id + 1)
                 yield cmd
-                break
 
 
-def number_of_cmds_by_which(cmds_file, which_list):
+def number_of_cmds_by_which(cmds_file, which_list, after_id=0):
     """Return number of all intercepted commands filtered by 'which' field.
 
     Args:
         cmds_file: Path to the txt file with intercepted commands.
         which_list: A list of strings to filter command by 'which' field.
+        after_id: Skip commands with id less or equal to the specified one.
     """
+    index = get_cmds_index(cmds_file)
+    which_ids = index.get_which_ids(which_list)
+
+    if not int(after_id):
+        stats = index.get_stats()
+        return sum(stats[index.which[i]] for i in which_ids)
 
-    i = 0
+    return sum(1 for i in index.which_ids[int(after_id):] if i in which_ids)
 
-    for _ in iter_cmds_by_which(cmds_file, which_list):
-        i += 1
 
-    return i
+def get_cmd_by_id(cmds_file, cmd_id):
+    """Get intercepted command by its id.
 
+    Raises:
+        IndexError: Command with specified id does not exist.
+    """
+    index = get_cmds_index(cmds_file)
 
-def iter_cmds(cmds_file):
+    if not 0 < int(cmd_id) <= len(index):
+        raise IndexError("Command with id {} does not exist".format(cmd_id))
+
+    with open_cmds_file(cmds_file) as cmds_fp:
+        cmds_fp.seek(index.offsets[int(cmd_id) - 1])
+        cmd = split_raw_cmd(next(iter_raw_cmds(cmds_fp)))
+
+    cmd["id"] = str(cmd_id)
+    return cmd
+
+
+def iter_cmds(cmds_file, after_id=0):
     """Get an iterator over all intercepted commands.
 
     Args:
         cmds_file: Path to the txt file with intercepted commands.
+        after_id: Skip commands with id less or equal to the specified one.
     """
+    after_id = int(after_id)
+
     with open_cmds_file(cmds_file) as cmds_fp:
-        for cmd_id, line in enumerate(cmds_fp):
-            cmd = split_cmd(line)
+        if after_id:
+            index = get_cmds_index(cmds_file)
+
+            if after_id >= len(index):
+                return
+
+            cmds_fp.seek(index.offsets[after_id])
+
+        for cmd_id, raw_cmd in enumerate(iter_raw_cmds(cmds_fp), start=after_id):
+            cmd = split_raw_cmd(raw_cmd)
             cmd["id"] = str(cmd_id + 1)  # cmd_id should be line number in cmds_fp file
             yield cmd
 
@@ -82,12 +518,32 @@ def split_cmd(line):
     return cmd
 
 
+def split_binary_cmd(record):
+    """Convert a single record of the binary file with intercepted commands into dictionary."""
+    header, data = record
+
+    cwd, which, *command = data[:-1].decode("utf-8").split("\0")
+    return {"cwd": cwd, "pid": str(header[3]), "which": which, "command": command}
+
+
 def join_cmd(cmd):
     """Convert a single intercepted command from dictionary to cmds.txt line."""
     line = DELIMITER.join([cmd["cwd"], cmd["pid"], cmd["which"]] + cmd["command"])
     return line
 
 
+def convert_binary_cmds(cmds_file, txt_file):
+    """Convert binary file with intercepted commands into the txt format.
+
+    Newlines in command arguments are escaped in the same way as the
+    libinterceptor does it for the txt format.
+    """
+    with open(txt_file, "w") as txt_fp:
+        for cmd in iter_cmds(cmds_file):
+            cmd["command"] = [re.sub(r"\r\n?|\n\r?", r"\\n", arg) for arg in cmd["command"]]
+            txt_fp.write(join_cmd(cmd) + "\n")
+
+
 def get_first_cmd(cmds_file):
     """Get first intercepted command."""
     return next(iter_cmds(cmds_file))
@@ -101,20 +557,13 @@ def get_build_dir(cmds_file):
 
 def get_last_cmd(cmds_file):
     """Get last intercepted command."""
-    iterable = iter_cmds(cmds_file)
-
-    last_cmd = next(iterable)
-    for last_cmd in iterable:
-        pass
-
-    return last_cmd
+    return get_cmd_by_id(cmds_file, len(get_cmds_index(cmds_file)))
 
 
 def get_last_id(cmds_file, raise_exception=False):
     """Get last used id."""
     try:
-        last_cmd = get_last_cmd(cmds_file)
-        return last_cmd["id"]
+        return str(len(get_cmds_index(cmds_file)))
     except RuntimeError:
         if raise_exception:
             raise
@@ -123,17 +572,9 @@ def get_last_id(cmds_file, raise_exception=False):
 
 def get_all_cmds(cmds_file):
     """Get list of all intercepted build commands."""
-    with open_cmds_file(cmds_file) as cmds_fp:
-        return list(iter_cmds(cmds_fp))
+    return list(iter_cmds(cmds_file))
 
 
 def get_stats(cmds_file):
     """Get statistics of intercepted commands number."""
-    stats = dict()
-    for cmd in iter_cmds(cmds_file):
-        if cmd["which"] in stats:
-            stats[cmd["which"]] += 1
-        else:
-            stats[cmd["which"]] = 1
-
-    return stats
+    return get_cmds_index(cmds_file).get_stats()
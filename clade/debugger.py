@@ -43,4 +43,7 @@ class Debugger(Intercept):
     def execute(self):
         self.command.insert(0, self.debugger)
         self.logger.debug("Execute {!r} command".format(self.command))
-        return subprocess.call(self.command, env=self.env, shell=False, cwd=self.cwd)
+        ret = subprocess.call(self.command, env=self.env, shell=False, cwd=self.cwd)
+
+        self.build_cmds_index()
+        return ret
@@ -16,14 +16,13 @@
 import abc
 import datetime
 import fnmatch
-import glob
-import hashlib
 import importlib
 import itertools
 import logging
 import platform
 import pkg_resources
 import os
+import pickle
 import re
 import shutil
 import subprocess
@@ -33,9 +32,10 @@ import time
 import ujson
 import uuid
 
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
 import clade.cmds
+from clade.extensions.backends import backends
 
 
 # Setup extensions logger
@@ -61,17 +61,29 @@ class Extension(metaclass=abc.ABCMeta):
 
     __version__ = "1"
 
+    # Extensions that can parse only commands appended to the file with
+    # intercepted commands since the previous launch. Other extensions
+    # are parsed from scratch in this case.
+    incremental = False
+
     def __init__(self, work_dir, conf=None):
         self.name = self.__class__.__name__
         self.work_dir = os.path.join(os.path.abspath(str(work_dir)), self.name)
         self.conf = conf if conf else dict()
         self.temp_dir = None
 
+        # Id of the last command parsed during the previous launch
+        self.parsed_id = 0
+
         if not hasattr(self, "requires"):
             self.requires = []
         self.debug("Extension requirements: {!r}".format(self.requires))
 
         self.extensions = dict()
+        self.__backends = dict()
+        self.__read_backends = dict()
+        self.__pending = dict()
+        self.__pending_size = 0
 
         logger.setLevel(self.conf.get("log_level", "INFO"))
 
@@ -94,6 +106,19 @@ class Extension(metaclass=abc.ABCMeta):
         """Returns True if build commands are already parsed."""
         return os.path.exists(self.work_dir)
 
+    def is_outdated(self, cmds_file):
+        """Returns True if new commands were intercepted since the last parse."""
+        if not self.is_parsed():
+            return False
+
+        stored_meta = self.load_global_meta().get(self.name, dict())
+
+        # Working directory was created by the older version of Clade
+        if "last_id" not in stored_meta:
+            return False
+
+        return int(stored_meta["last_id"]) < int(clade.cmds.get_last_id(cmds_file))
+
     def preprocess(self, cmd):
         """Preprocess intercepted build command before its execution"""
         return
@@ -107,7 +132,18 @@ class Extension(metaclass=abc.ABCMeta):
         """
 
         def parse_wrapper(self, *args, **kwargs):
-            if self.is_parsed():
+            cmds_file = args[0]
+
+            if self.is_outdated(cmds_file):
+                stored_meta = self.load_global_meta()[self.name]
+
+                if self.incremental:
+                    self.parsed_id = int(stored_meta["last_id"])
+                    self.log("Parsing commands intercepted after command {}".format(self.parsed_id))
+                else:
+                    self.log("New commands were intercepted, so the build commands are parsed again")
+                    shutil.rmtree(self.work_dir)
+            elif self.is_parsed():
                 self.log("Build commands are already parsed")
                 return
 
@@ -115,7 +151,10 @@ class Extension(metaclass=abc.ABCMeta):
             time_start = time.time()
 
             try:
-                return parse(self, *args, **kwargs)
+                ret = parse(self, *args, **kwargs)
+                self.flush_data_by_key()
+                self.ext_meta["last_id"] = clade.cmds.get_last_id(cmds_file)
+                return ret
             except Exception:
                 if os.path.exists(self.work_dir):
                     self.ext_meta["corrupted"] = True
@@ -130,7 +169,7 @@ class Extension(metaclass=abc.ABCMeta):
                 )
 
                 if os.path.exists(os.path.dirname(self.work_dir)):
-                    self.dump_global_meta(args[0])
+                    self.dump_global_meta(cmds_file)
 
         return parse_wrapper
 
@@ -193,32 +232,95 @@ class Extension(metaclass=abc.ABCMeta):
 
     def load_data_by_key(self, folder, files=None):
         """Load data stored in multiple json files using dump_data_by_key()."""
-        if files and not isinstance(files, list) and not isinstance(files, set):
-            raise TypeError(
-                "Provide a list or set of files to retrieve data but not {!r}".format(
-                    type(files).__name__
-                )
-            )
-
-        data = dict()
+        self.__check_files_type(files)
 
         if files:
             self.debug("Loading data from {!r}: {!r}".format(folder, files))
-            for key in files:
-                file = os.path.join(
-                    folder,
-                    hashlib.md5(key.encode("utf-8")).hexdigest() + ".json",
-                )
-                data.update(self.load_data(file, raise_exception=False))
         else:
             self.debug("Loading all data from {!r}".format(folder))
-            for file in self.__get_all_files_in_folder(folder):
-                data.update(self.load_data(file, raise_exception=False))
 
-        return data
+        return dict(self.__load_data_by_key(folder, files))
 
     def yield_data_by_key(self, folder, files=None):
         """Yield data stored in multiple json files using dump_data_by_key()."""
+        self.__check_files_type(files)
+
+        if files:
+            self.debug("Yielding data from {!r}: {!r}".format(folder, files))
+        else:
+            self.debug("Yielding all data from {!r}".format(folder))
+
+        for key, value in self.__load_data_by_key(folder, files):
+            yield key, {key: value}
+
+    def __load_data_by_key(self, folder, files):
+        if not files:
+            self.__flush_folder(folder)
+            yield from self.__get_backend(folder).load()
+            return
+
+        # Data that is not written yet is taken directly from the buffer
+        pending = self.__pending.get(os.path.join(self.work_dir, folder), dict())
+        yield from ((key, pending[key]) for key in files if key in pending)
+
+        files = [key for key in files if key not in pending]
+        if files:
+            yield from self.__get_backend(folder).load(files)
+
+    def dump_data_by_key(self, data, folder):
+        """Dump data to multiple json files in the object working directory.
+
+        Data is not written immediately: it is accumulated in memory until
+        the number of buffered keys exceeds "data_buffer_size" option,
+        or until flush_data_by_key() is called. Thus, data must not be
+        changed after it is passed to this method.
+        """
+        buffer_size = self.conf.get("data_buffer_size", 0)
+
+        if not buffer_size:
+            self.debug("Dumping data to {!r}".format(folder))
+            self.__get_backend(folder, write=True).dump(data)
+            return
+
+        folder = os.path.join(self.work_dir, folder)
+
+        if folder not in self.__pending:
+            self.__pending[folder] = dict()
+
+        pending = self.__pending[folder]
+        self.__pending_size -= len(pending)
+        pending.update(data)
+        self.__pending_size += len(pending)
+
+        if self.__pending_size >= buffer_size:
+            self.flush_data_by_key(recursive=False)
+
+    def flush_data_by_key(self, recursive=True):
+        """Write all data buffered by dump_data_by_key().
+
+        If recursive is True, buffered data of all required extensions
+        is written as well.
+        """
+        for folder in list(self.__pending):
+            self.__flush_folder(folder)
+
+        if recursive:
+            for ext in self.extensions.values():
+                ext.flush_data_by_key()
+
+    def __flush_folder(self, folder):
+        folder = os.path.join(self.work_dir, folder)
+        pending = self.__pending.pop(folder, None)
+
+        if not pending:
+            return
+
+        self.__pending_size -= len(pending)
+        self.debug("Dumping {} keys to {!r}".format(len(pending), folder))
+        self.__get_backend(folder, write=True).dump(pending)
+
+    @staticmethod
+    def __check_files_type(files):
         if files and not isinstance(files, list) and not isinstance(files, set):
             raise TypeError(
                 "Provide a list or set of files to retrieve data but not {!r}".format(
@@ -226,39 +328,37 @@ class Extension(metaclass=abc.ABCMeta):
                 )
             )
 
-        if files:
-            self.debug("Yielding data from {!r}: {!r}".format(folder, files))
-            for key in files:
-                file = os.path.join(
-                    folder,
-                    hashlib.md5(key.encode("utf-8")).hexdigest() + ".json",
-                )
+    def __get_backend(self, folder, write=False):
+        """Get backend that stores data of a given folder.
 
-                data = self.load_data(file, raise_exception=False)
-                for key in data:
-                    yield key, data
-        else:
-            self.debug("Yielding all data from {!r}".format(folder))
-            for file in self.__get_all_files_in_folder(folder):
-                data = self.load_data(file, raise_exception=False)
-                for key in data:
-                    yield key, data
+        Data is always written by the backend specified in the configuration,
+        but it can be read from the folder created by any other backend.
+        """
+        folder = os.path.join(self.work_dir, folder)
 
-    def __get_all_files_in_folder(self, folder):
-        return glob.glob(os.path.join(self.work_dir, folder, "*"))
+        if not write and folder in self.__read_backends:
+            return self.__read_backends[folder]
 
-    def dump_data_by_key(self, data, folder):
-        """Dump data to multiple json files in the object working directory."""
-        self.debug("Dumping data to {!r}".format(folder))
+        name = self.conf.get("Extension.data_backend", "json")
 
-        for key in data:
-            to_dump = {key: data[key]}
+        if name not in backends:
+            raise RuntimeError("Data backend {!r} is not supported".format(name))
 
-            file_name = os.path.join(
-                folder, hashlib.md5(key.encode("utf-8")).hexdigest() + ".json"
-            )
+        if write:
+            return self.__create_backend(name, folder)
+
+        for b in [name] + [b for b in backends if b != name]:
+            if backends[b].exists(folder):
+                self.__read_backends[folder] = self.__create_backend(b, folder)
+                return self.__read_backends[folder]
+
+        return self.__create_backend(name, folder)
 
-            self.dump_data(to_dump, file_name, indent=0)
+    def __create_backend(self, name, folder):
+        if (name, folder) not in self.__backends:
+            self.__backends[(name, folder)] = backends[name](self, folder)
+
+        return self.__backends[(name, folder)]
 
     def get_ext_version(self):
         version = self.__version__
@@ -420,13 +520,20 @@ class Extension(metaclass=abc.ABCMeta):
                 return
 
     def parse_cmds_in_parallel(self, cmds, unwrap, total_cmds=None):
+        """Parse commands in child processes using unwrap(self, cmd) function.
+
+        Returns:
+            List of all values returned by unwrap() function, except None.
+        """
         if os.environ.get("CLADE_DEBUG"):
             if total_cmds:
                 self.log("Parsing {} commands".format(total_cmds))
 
-            for cmd in cmds:
-                unwrap(self, cmd)
-            return
+            results = (unwrap(self, cmd) for cmd in cmds)
+            return [r for r in results if r is not None]
+
+        # Otherwise buffered data will be copied to each child process
+        self.flush_data_by_key()
 
         if self.conf.get("cpu_count"):
             max_workers = self.conf.get("cpu_count")
@@ -441,65 +548,113 @@ class Extension(metaclass=abc.ABCMeta):
         if total_cmds:
             self.log("Parsing {} commands".format(total_cmds))
 
-        with ProcessPoolExecutor(max_workers=max_workers) as p:
-            chunk_size = 2000
-            futures = []
-            finished_cmds = 0
+        # Several commands are sent to the child process at once,
+        # but there should be enough batches to balance the load
+        if total_cmds:
+            batch_size = max(1, min(100, total_cmds // (max_workers * 8)))
+        else:
+            batch_size = 10
 
-            # Submit commands to executor in chunks
-            for cmd_chunk in self.__get_cmd_chunk(cmds, chunk_size=chunk_size):
-                chunk_futures = []
+        # Limit the number of submitted batches so that commands
+        # are not read from generator faster than they are parsed
+        max_futures = max_workers * 2
 
-                for cmd in cmd_chunk:
-                    f = p.submit(unwrap, self, cmd)
-                    chunk_futures.append(f)
-                    futures.append(f)
+        # Extension object is sent to each child process only once
+        if sys.version_info >= (3, 7):
+            executor_args = {"initializer": init_worker, "initargs": (self,)}
+            task_ext = None
+        else:
+            executor_args = dict()
+            task_ext = self
+
+        # Measuring size of the data sent to child processes is not free
+        measure_ipc = self.conf.get("log_level") == "DEBUG"
+        ipc_bytes = 0
+        ipc_tasks = 0
+
+        if measure_ipc:
+            self.debug("Size of the extension object sent to each child process: {} bytes".format(
+                len(pickle.dumps(self))
+            ))
+
+        show_progress = (
+            total_cmds
+            and sys.stdout.isatty()
+            and self.conf.get("log_level") in ["INFO", "DEBUG"]
+        )
+        finished_cmds = 0
+        results = []
 
-                while True:
-                    if not futures:
-                        break
+        with ProcessPoolExecutor(max_workers=max_workers, **executor_args) as p:
+            futures = set()
 
-                    done_futures = [x for x in futures if x.done()]
-
-                    # Remove all futures that are already completed
-                    # to reduce memory usage
-                    futures = [x for x in futures if not x.done()]
-
-                    # Track progress (only if stdout is not redirected)
-                    if total_cmds and sys.stdout.isatty() and self.conf["log_level"] in ["INFO", "DEBUG"]:
-                        finished_cmds += len(done_futures)
-
-                        msg = "\t [{:.0f}%] {} of {} commands are parsed".format(
-                            finished_cmds / total_cmds * 100,
-                            finished_cmds,
-                            total_cmds,
-                        )
-                        print(msg, end="\r")
-
-                    # Check return value of all finished futures
-                    for f in done_futures:
-                        try:
-                            f.result()
-                        except Exception as e:
-                            raise RuntimeError(
-                                "Something happened in the child process: {}".format(
-                                    e
-                                )
-                            )
-
-                    # Submit next chunk if the current one is almost processed
-                    finished_chunk_cmds = len(
-                        [x for x in chunk_futures if x.done()]
-                    )
-                    if finished_chunk_cmds > (chunk_size - chunk_size // 10):
-                        break
+            try:
+                for batch in self.__get_cmd_chunk(cmds, chunk_size=batch_size):
+                    while len(futures) >= max_futures:
+                        finished_cmds += self.__wait_for_futures(futures, results)
+
+                        if show_progress:
+                            self.__print_progress(finished_cmds, total_cmds)
+
+                    futures.add(p.submit(unwrap_cmds, unwrap, batch, task_ext))
+
+                    if measure_ipc:
+                        ipc_bytes += len(pickle.dumps((unwrap_cmds, unwrap, batch, task_ext)))
+                        ipc_tasks += 1
+
+                while futures:
+                    finished_cmds += self.__wait_for_futures(futures, results)
+
+                    if show_progress:
+                        self.__print_progress(finished_cmds, total_cmds)
+            finally:
+                # Do not wait for commands that will not be parsed anyway
+                for f in futures:
+                    f.cancel()
 
-                    # Save a little bit of CPU time
-                    # skip sleep only for very small projects
-                    time.sleep(0.1)
+        if show_progress:
+            print(" " * 79, end="\r")
 
-            if total_cmds and sys.stdout.isatty() and self.conf["log_level"] in ["INFO", "DEBUG"]:
-                print(" " * 79, end="\r")
+        if ipc_tasks:
+            self.debug("Sent {} bytes to child processes in {} tasks ({:.0f} bytes per task)".format(
+                ipc_bytes, ipc_tasks, ipc_bytes / ipc_tasks
+            ))
+
+        return results
+
+    @staticmethod
+    def __wait_for_futures(futures, results):
+        """Wait until at least one future is done and remove all finished ones.
+
+        Values returned by finished futures are added to results list.
+
+        Returns:
+            Number of parsed commands.
+        """
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+        finished_cmds = 0
+
+        for f in done:
+            futures.remove(f)
+
+            try:
+                batch_size, batch_results = f.result()
+                finished_cmds += batch_size
+                results.extend(batch_results)
+            except Exception as e:
+                raise RuntimeError(
+                    "Something happened in the child process: {}".format(e)
+                )
+
+        return finished_cmds
+
+    @staticmethod
+    def __print_progress(finished_cmds, total_cmds):
+        msg = "\t [{:.0f}%] {} of {} commands are parsed".format(
+            finished_cmds / total_cmds * 100, finished_cmds, total_cmds
+        )
+        print(msg, end="\r")
 
     @staticmethod
     def get_all_extensions():
@@ -577,3 +732,29 @@ class Extension(metaclass=abc.ABCMeta):
         self.conf["log_level"] must be set to ERROR, WARNING, INFO or DEBUG in order to see the message.
         """
         logger.error("{}: {}".format(self.name, message))
+
+
+# Extension object received by the child process from init_worker()
+worker_ext = None
+
+
+def init_worker(ext):
+    """Initialize child process with the extension object, which will parse commands."""
+    global worker_ext
+    worker_ext = ext
+
+
+def unwrap_cmds(unwrap, cmds, ext=None):
+    """Parse batch of commands in the child process and write all buffered data.
+
+    Data buffered by the extension object must be written after each
+    batch, since child processes can be terminated at any time after it.
+    """
+    if ext is None:
+        ext = worker_ext
+
+    results = (unwrap(ext, cmd) for cmd in cmds)
+    results = [r for r in results if r is not None]
+
+    ext.flush_data_by_key()
+    return len(cmds), results
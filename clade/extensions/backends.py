@@ -0,0 +1,173 @@
+# Copyright (c) 2020 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import abc
+import glob
+import hashlib
+import itertools
+import os
+import sqlite3
+import ujson
+
+
+class Backend(metaclass=abc.ABCMeta):
+    """Parent interface class for storing data grouped by key.
+
+    Backend is used by Extension.dump_data_by_key(), load_data_by_key()
+    and yield_data_by_key() methods.
+
+    Attributes:
+        ext: Extension object that owns the data
+        folder: An absolute path to the folder where data is stored
+    """
+
+    def __init__(self, ext, folder):
+        self.ext = ext
+        self.folder = folder
+
+    @classmethod
+    @abc.abstractmethod
+    def exists(cls, folder):
+        """Check that folder contains data stored by this backend."""
+        pass
+
+    @abc.abstractmethod
+    def dump(self, data):
+        """Store values of all keys from data dictionary."""
+        pass
+
+    @abc.abstractmethod
+    def load(self, keys=None):
+        """Yield (key, value) pairs for all specified keys (or all stored ones)."""
+        pass
+
+
+class JSONBackend(Backend):
+    """Stores value of each key in a separate json file named by the md5 hash of the key."""
+
+    @classmethod
+    def exists(cls, folder):
+        try:
+            return any(name.endswith(".json") for name in os.listdir(folder))
+        except FileNotFoundError:
+            return False
+
+    def dump(self, data):
+        for key in data:
+            self.ext.dump_data({key: data[key]}, self.__get_file(key), indent=0)
+
+    def load(self, keys=None):
+        if keys is not None:
+            files = (self.__get_file(key) for key in keys)
+        else:
+            files = glob.glob(os.path.join(self.folder, "*.json"))
+
+        for file in files:
+            yield from self.ext.load_data(file, raise_exception=False).items()
+
+    def __get_file(self, key):
+        return os.path.join(
+            self.folder, hashlib.md5(key.encode("utf-8")).hexdigest() + ".json"
+        )
+
+
+class SQLiteBackend(Backend):
+    """Stores all keys of the folder in a single SQLite database file."""
+
+    db_name = "data_by_key.db"
+
+    # SQLite limits the number of parameters in a single statement
+    chunk_size = 500
+
+    def __init__(self, ext, folder):
+        super().__init__(ext, folder)
+
+        self.db = os.path.join(folder, self.db_name)
+        self.__conn = None
+        self.__pid = None
+
+    def __getstate__(self):
+        # Connections can't be pickled and must not be shared between processes
+        state = self.__dict__.copy()
+        state["_SQLiteBackend__conn"] = None
+        state["_SQLiteBackend__pid"] = None
+        return state
+
+    @classmethod
+    def exists(cls, folder):
+        return os.path.isfile(os.path.join(folder, cls.db_name))
+
+    def dump(self, data):
+        if not data:
+            return
+
+        conn = self.__connect()
+
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO data (key, value) VALUES (?, ?)",
+                (
+                    (key, ujson.dumps(data[key], ensure_ascii=False, escape_forward_slashes=False))
+                    for key in data
+                ),
+            )
+
+    def load(self, keys=None):
+        if not os.path.isfile(self.db):
+            return
+
+        conn = self.__connect()
+
+        if keys is None:
+            rows = conn.execute("SELECT key, value FROM data").fetchall()
+            yield from ((key, ujson.loads(value)) for key, value in rows)
+            return
+
+        keys_it = iter(keys)
+
+        while True:
+            chunk = list(itertools.islice(keys_it, self.chunk_size))
+
+            if not chunk:
+                return
+
+            rows = conn.execute(
+                "SELECT key, value FROM data WHERE key IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                chunk,
+            ).fetchall()
+
+            yield from ((key, ujson.loads(value)) for key, value in rows)
+
+    def __connect(self):
+        if self.__conn and self.__pid == os.getpid():
+            return self.__conn
+
+        os.makedirs(self.folder, exist_ok=True)
+
+        # Several processes can write to the same database simultaneously
+        self.__conn = sqlite3.connect(self.db, timeout=600)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        self.__conn.execute(
+            "CREATE TABLE IF NOT EXISTS data (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.__pid = os.getpid()
+
+        return self.__conn
+
+
+backends = {"json": JSONBackend, "sqlite": SQLiteBackend}
@@ -13,12 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import functools
+import array
 import os
 import re
+import shutil
+import zlib
 
 from clade.extensions.abstract import Extension
-from clade.extensions.utils import nested_dict, traverse
+from clade.extensions.src_graph import cmd_sets_intersect
+from clade.extensions.utils import StringTable, nested_dict
 
 
 class Callgraph(Extension):
@@ -29,13 +32,25 @@ class Callgraph(Extension):
     def __init__(self, work_dir, conf=None):
         super().__init__(work_dir, conf)
 
-        self.src_graph = dict()
+        self.compiled_in_sets = dict()
+        self.used_by_sets = dict()
         self.funcs = dict()
 
         self.err_log = os.path.join(self.work_dir, "err.log")
 
-        self.callgraph = nested_dict()
+        # The same file paths and function names occur in millions of calls
+        self.strings = StringTable()
+
+        self.callgraph = CallEdges(self.strings)
         self.callgraph_folder = "callgraph"
+        self.callgraph_shards_folder = "callgraph_shards"
+
+        # Calls are resolved in several processes, each one processes
+        # calls of functions with names from its own shard
+        if self.conf.get("Callgraph.parallel"):
+            self.shards = self.conf.get("cpu_count") or os.cpu_count()
+        else:
+            self.shards = 1
 
         self.calls_by_ptr = nested_dict()
         self.calls_by_ptr_file = "calls_by_ptr.json"
@@ -49,22 +64,33 @@ class Callgraph(Extension):
     def parse(self, cmds_file):
         self.log("Generating callgraph")
 
-        self.src_graph = self.extensions["SrcGraph"].load_src_graph()
+        self._load_src_graph()
         self.funcs = self.extensions["Functions"].load_functions()
 
-        self.__process_calls()
+        if self.shards > 1:
+            shards_by_file = self.__process_calls_in_parallel()
+            callgraph = self.__merge_callgraph_shards(shards_by_file)
+        else:
+            self.__process_calls(self.callgraph)
+            callgraph = self.callgraph.items()
+
         self.__process_calls_by_pointers()
         self.__process_functions_usages()
         self._clean_error_log()
 
-        self.dump_data_by_key(self.callgraph, self.callgraph_folder)
+        self.__dump_callgraph(callgraph)
         self.dump_data(self.calls_by_ptr, self.calls_by_ptr_file)
         self.dump_data(self.used_in, self.used_in_file)
 
-        self.src_graph.clear()
+        self._clear_src_graph()
         self.funcs.clear()
         self.callgraph.clear()
         self.used_in.clear()
+        self.strings.clear()
+
+        shards_folder = os.path.join(self.work_dir, self.callgraph_shards_folder)
+        if os.path.exists(shards_folder):
+            shutil.rmtree(shards_folder)
 
         self.log("Generating finished")
 
@@ -80,11 +106,54 @@ class Callgraph(Extension):
     def load_used_in(self):
         return self.load_data(self.used_in_file)
 
-    def __process_calls(self):
+    def _process_calls_shard(self, shard):
+        callgraph = CallEdges(self.strings)
+        self.__process_calls(callgraph, shard)
+
+        folder = os.path.join(self.callgraph_shards_folder, str(shard))
+        files = self.__dump_in_batches(callgraph.items(), folder)
+
+        return shard, files
+
+    def __process_calls_in_parallel(self):
+        self.log("Resolving calls in {} shards".format(self.shards))
+
+        results = self.parse_cmds_in_parallel(
+            range(self.shards), Callgraph._process_calls_shard, total_cmds=self.shards
+        )
+
+        # Parts of the callgraph of the same file are stored in different shards
+        shards_by_file = dict()
+        for shard, files in sorted(results):
+            for file in files:
+                shards_by_file.setdefault(file, []).append(shard)
+
+        return shards_by_file
+
+    def __merge_callgraph_shards(self, shards_by_file):
+        for file, shards in shards_by_file.items():
+            funcs = dict()
+
+            for shard in shards:
+                folder = os.path.join(self.callgraph_shards_folder, str(shard))
+                merge_callgraph_parts(funcs, self.load_data_by_key(folder, [file])[file])
+
+            yield file, funcs
+
+    def __process_calls(self, callgraph, shard=0):
         is_bad = re.compile(r'__bad')
+        intern = self.strings.intern
 
         for context_file, context_func, func, call_line, call_type, args in self.extensions["Info"].iter_calls():
-            if self.is_builtin.match(func) or (is_bad.match(func) and func not in self.callgraph):
+            if self.shards > 1 and zlib.crc32(func.encode("utf-8")) % self.shards != shard:
+                continue
+
+            context_file = intern(context_file)
+            context_func = intern(context_func)
+            func = intern(func)
+            call_line = intern(call_line)
+
+            if self.is_builtin.match(func) or (is_bad.match(func) and func not in callgraph):
                 continue
 
             # For each function call there can be many definitions with the same name, defined in different
@@ -121,38 +190,66 @@ class Callgraph(Extension):
             if len(matched_files) > 1:
                 self._error("Multiple matches: {} {}".format(func, context_func))
 
+            if args:
+                args = [(intern(arg_pos), intern(arg_func)) for arg_pos, arg_func in args]
+
             for possible_file in matched_files:
-                call_val = {
-                    'match_type': index,
-                }
+                # Both direct and reversed callgraphs are created from these edges
+                callgraph.add(possible_file, func, context_file, context_func, call_line, index, args)
 
-                if args:
-                    call_val["args"] = args
+                if possible_file == "unknown":
+                    self._error("Can't match definition: {} {}".format(func, context_file))
 
-                self.callgraph[possible_file][func]['called_in'][context_file][context_func][call_line] = call_val
+    def __add_types(self, callgraph):
+        for path, funcs in callgraph:
+            # Keep function types in the callgraph
+            for func in funcs:
+                if path == "unknown" and (func not in self.funcs or not self.funcs[func].get(path)):
+                    continue
 
-                # Create reversed callgraph
-                self.callgraph[context_file][context_func]["calls"][possible_file][func][call_line] = call_val
+                funcs[func]["type"] = self.funcs[func][path]["type"]
 
-                if possible_file == "unknown":
-                    self._error("Can't match definition: {} {}".format(func, context_file))
+            yield path, funcs
 
-        # Keep function types in the callgraph
-        for path, func in traverse(self.callgraph, 2):
-            if path == "unknown" and (func not in self.funcs or not self.funcs[func].get(path)):
-                continue
+    def __dump_callgraph(self, callgraph):
+        self.__dump_in_batches(self.__add_types(callgraph), self.callgraph_folder)
+
+    def __dump_in_batches(self, items, folder):
+        """Dump data in parts to avoid creating the whole nested dictionary at once."""
+        keys = []
+        batch = dict()
+
+        for key, value in items:
+            keys.append(key)
+            batch[key] = value
+
+            if len(batch) >= 100:
+                self.dump_data_by_key(batch, folder)
+                self.flush_data_by_key(recursive=False)
+                batch = dict()
+
+        self.dump_data_by_key(batch, folder)
+        self.flush_data_by_key(recursive=False)
 
-            self.callgraph[path][func]["type"] = self.funcs[func][path]["type"]
+        return keys
 
     def __process_calls_by_pointers(self):
+        intern = self.strings.intern
+
         for context_file, context_func, func_ptr, call_line in self.extensions["Info"].iter_calls_by_pointers():
+            context_file, context_func, func_ptr, call_line = map(intern, (context_file, context_func, func_ptr, call_line))
+
             if func_ptr not in self.calls_by_ptr[context_file][context_func]:
                 self.calls_by_ptr[context_file][context_func][func_ptr] = [call_line]
             else:
                 self.calls_by_ptr[context_file][context_func][func_ptr].append(call_line)
 
     def __process_functions_usages(self):
+        intern = self.strings.intern
+
         for context_file, context_func, func, line in self.extensions["Info"].iter_functions_usages():
+            context_file, context_func, func, line = map(intern, (context_file, context_func, func, line))
+
             if self.is_builtin.match(func):
                 continue
 
@@ -190,6 +287,8 @@ class Callgraph(Extension):
                 self._error("Multiple matches for use: {} call in {}".format(func, context_func))
 
             for possible_file in matched_files:
+                possible_file = intern(possible_file)
+
                 if func not in self.used_in[possible_file]:
                     self.used_in[possible_file][func] = {"used_in_file": nested_dict(), "used_in_func": nested_dict()}
 
@@ -201,28 +300,29 @@ class Callgraph(Extension):
                 if possible_file == "unknown":
                     self._error("Can't match definition for use: {} {}".format(func, context_file))
 
-    @functools.lru_cache()
+    def _load_src_graph(self):
+        # Only sets of commands are kept, since the whole source graph is too large
+        src_graph = self.extensions["SrcGraph"].load_src_graph()
+        self.compiled_in_sets = self.extensions["SrcGraph"].load_src_cmd_sets(
+            "compiled_in", src_graph
+        )
+        self.used_by_sets = self.extensions["SrcGraph"].load_src_cmd_sets(
+            "used_by", src_graph
+        )
+
+    def _clear_src_graph(self):
+        self.compiled_in_sets.clear()
+        self.used_by_sets.clear()
+
     def _t_unit_is_common(self, file1, file2):
-        return (
-            file1 in self.src_graph
-            and file2 in self.src_graph
-            and len(
-                set(self.src_graph[file1]["compiled_in"])
-                & set(self.src_graph[file2]["compiled_in"])
-            )
-            > 0
+        # Files that are not in the source graph have empty sets
+        return cmd_sets_intersect(
+            self.compiled_in_sets.get(file1, 0), self.compiled_in_sets.get(file2, 0)
         )
 
-    @functools.lru_cache()
     def _files_are_linked(self, file1, file2):
-        return (
-            file1 in self.src_graph
-            and file2 in self.src_graph
-            and len(
-                set(self.src_graph[file1]["used_by"])
-                & set(self.src_graph[file2]["used_by"])
-            )
-            > 0
+        return cmd_sets_intersect(
+            self.used_by_sets.get(file1, 0), self.used_by_sets.get(file2, 0)
         )
 
     def _error(self, msg):
@@ -250,3 +350,132 @@ class Callgraph(Extension):
 
         os.remove(self.err_log)
         os.rename(self.err_log + ".temp", self.err_log)
+
+
+def merge_callgraph_parts(funcs, part):
+    """Merge parts of the callgraph of the same file built by different shards.
+
+    Calls of each function are resolved by a single shard, so
+    only lists of functions called by the same caller can overlap.
+    """
+    for func, value in part.items():
+        if func not in funcs:
+            funcs[func] = value
+            continue
+
+        for key in value:
+            if key == "calls":
+                calls = funcs[func].setdefault("calls", dict())
+
+                for callee_file, callees in value["calls"].items():
+                    calls.setdefault(callee_file, dict()).update(callees)
+            else:
+                funcs[func][key] = value[key]
+
+
+class CallEdges:
+    """Compact store of function calls used to build the callgraph.
+
+    Each call is stored as a row of parallel arrays with ids of strings
+    from the string table, which takes tens of bytes instead of several
+    levels of nested dictionaries. Nested dictionaries of the callgraph
+    are created only when the callgraph is dumped, one file at a time.
+    """
+
+    def __init__(self, strings):
+        self.strings = strings
+
+        self.callee_files = array.array("I")
+        self.callee_funcs = array.array("I")
+        self.caller_files = array.array("I")
+        self.caller_funcs = array.array("I")
+        self.lines = array.array("I")
+        self.match_types = array.array("b")
+        # Index of call arguments in the args list, or -1
+        self.args_ids = array.array("i")
+        self.args = []
+
+        self.files = set()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __contains__(self, file):
+        return file in self.strings and self.strings.get_id(file) in self.files
+
+    def add(self, callee_file, callee_func, caller_file, caller_func, line, match_type, args=None):
+        get_id = self.strings.get_id
+
+        self.callee_files.append(get_id(callee_file))
+        self.callee_funcs.append(get_id(callee_func))
+        self.caller_files.append(get_id(caller_file))
+        self.caller_funcs.append(get_id(caller_func))
+        self.lines.append(get_id(line))
+        self.match_types.append(match_type)
+
+        if args:
+            self.args_ids.append(len(self.args))
+            self.args.append(args)
+        else:
+            self.args_ids.append(-1)
+
+        self.files.add(self.callee_files[-1])
+        self.files.add(self.caller_files[-1])
+
+    def items(self):
+        """Yield file and the part of the callgraph that belongs to it."""
+        get_str = self.strings.get_str
+
+        # Calls are replayed in the original order, so the callgraph stays the same
+        calls_by_file = dict()
+        for i, (callee_file, caller_file) in enumerate(zip(self.callee_files, self.caller_files)):
+            calls_by_file.setdefault(callee_file, array.array("I")).append(i)
+
+            if caller_file != callee_file:
+                calls_by_file.setdefault(caller_file, array.array("I")).append(i)
+
+        # Values of calls without arguments are equal, so they can be shared
+        call_vals = dict()
+
+        for file_id, calls in calls_by_file.items():
+            funcs = nested_dict()
+
+            for i in calls:
+                callee_func = get_str(self.callee_funcs[i])
+                caller_func = get_str(self.caller_funcs[i])
+                line = get_str(self.lines[i])
+
+                if self.args_ids[i] >= 0:
+                    call_val = {
+                        'match_type': self.match_types[i],
+                        'args': self.args[self.args_ids[i]],
+                    }
+                elif self.match_types[i] in call_vals:
+                    call_val = call_vals[self.match_types[i]]
+                else:
+                    call_val = call_vals[self.match_types[i]] = {'match_type': self.match_types[i]}
+
+                if self.callee_files[i] == file_id:
+                    caller_file = get_str(self.caller_files[i])
+                    funcs[callee_func]['called_in'][caller_file][caller_func][line] = call_val
+
+                if self.caller_files[i] == file_id:
+                    callee_file = get_str(self.callee_files[i])
+                    funcs[caller_func]["calls"][callee_file][callee_func][line] = call_val
+
+            yield get_str(file_id), funcs
+
+    def clear(self):
+        for column in (
+            self.callee_files,
+            self.callee_funcs,
+            self.caller_files,
+            self.caller_funcs,
+            self.lines,
+            self.match_types,
+            self.args_ids,
+        ):
+            del column[:]
+
+        self.args.clear()
+        self.files.clear()
@@ -13,10 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os
+import re
 import shlex
 import subprocess
 
+from clade.cmds import DEPS_SUFFIX
 from clade.extensions.compiler import Compiler
 from clade.extensions.opts import cc_preprocessor_opts
 
@@ -26,9 +29,50 @@ class CC(Compiler):
 
     __version__ = "1"
 
+    def __init__(self, work_dir, conf=None):
+        super().__init__(work_dir, conf)
+
+        # Path to the file with intercepted commands, which is known only during parsing
+        self.cmds_file = None
+
     def parse(self, cmds_file):
+        self.cmds_file = os.path.abspath(cmds_file)
         super().parse(cmds_file, self.conf.get("CC.which_list", []))
 
+    def preprocess(self, cmd):
+        """Ask the compiler to write dependencies while the build command is executed.
+
+        Dependencies are collected by the compiler itself, if the corresponding
+        environment variable is set, so there is no need to rerun it during parsing.
+        """
+        if not self.conf.get("CC.intercept_deps"):
+            return
+
+        if not any(re.search(w, cmd["which"]) for w in self.conf.get("CC.which_list", [])):
+            return
+
+        if "-cc1" in cmd["command"] or cmd["which"].endswith("cc1"):
+            return
+
+        deps_file = self.__get_intercepted_deps_file(self.conf["cmds_file"], cmd)
+        os.makedirs(os.path.dirname(deps_file), exist_ok=True)
+
+        # Compiler appends dependencies to the existing file
+        if os.path.exists(deps_file):
+            os.remove(deps_file)
+
+        if self.conf.get("CC.with_system_header_files"):
+            env_name = "SUNPRO_DEPENDENCIES"
+        else:
+            env_name = "DEPENDENCIES_OUTPUT"
+
+        cmd.setdefault("env", dict())[env_name] = deps_file
+
+    @staticmethod
+    def __get_intercepted_deps_file(cmds_file, cmd):
+        h = hashlib.md5("\0".join([cmd["cwd"], cmd["which"]] + cmd["command"]).encode("utf-8"))
+        return os.path.join(cmds_file + DEPS_SUFFIX, h.hexdigest() + ".d")
+
     def parse_cmd(self, cmd):
         cmd_id = cmd["id"]
 
@@ -63,7 +107,9 @@ class CC(Compiler):
                 if os.path.exists(file):
                     os.remove(file)
 
-        deps = self.__get_deps(cmd_id, parsed_cmd)
+        cache_stats = {"hits": 0, "misses": 0}
+
+        deps = self.__get_deps(cmd_id, cmd, parsed_cmd, cache_stats)
         self.debug("Dependencies: {}".format(deps))
         self.dump_deps_by_id(cmd_id, deps)
         self.dump_cmd_by_id(cmd_id, parsed_cmd)
@@ -73,21 +119,106 @@ class CC(Compiler):
         ) and self.is_a_compilation_command(parsed_cmd):
             self.store_deps_files(deps, parsed_cmd["cwd"])
 
-    def __get_deps(self, cmd_id, cmd):
+        if self.deps_cache_dir:
+            return cache_stats
+
+    def __get_deps(self, cmd_id, raw_cmd, cmd, cache_stats):
         """Get a list of CC command dependencies."""
         deps = []
 
+        rules = []
+        if self.conf.get("CC.intercept_deps") and self.cmds_file:
+            rules = self.__get_intercepted_deps(raw_cmd)
+
         for cmd_in in cmd["in"]:
-            self.debug("Collecting dependencies for {!r} file".format(cmd_in))
-            deps_file = self.__collect_deps(cmd_id, cmd, cmd_in)
+            # Compiler writes a separate rule for each input file
+            target = os.path.basename(os.path.splitext(cmd_in)[0] + ".o")
+
+            while rules and rules[0][0] != target:
+                rules.pop(0)
+
+            # Content of stdin is unknown, so its dependencies can't be cached
+            use_cache = self.deps_cache_dir and cmd_in != "-"
+
+            in_deps = None
+            if rules:
+                self.debug("Using intercepted dependencies for {!r} file".format(cmd_in))
+                in_deps = [cmd_in] + rules.pop(0)[1]
+            elif use_cache:
+                in_deps = self.load_deps_from_cache(cmd, cmd_in)
+
+                if in_deps is not None:
+                    cache_stats["hits"] += 1
+                else:
+                    cache_stats["misses"] += 1
+
+            if in_deps is None:
+                self.debug("Collecting dependencies for {!r} file".format(cmd_in))
+                deps_file, collected = self.__collect_deps(cmd_id, cmd, cmd_in)
+                in_deps = self.__parse_deps(deps_file)
+
+                # Dependencies of a failed command may be incomplete, so they are not cached
+                if use_cache and collected:
+                    self.dump_deps_to_cache(cmd, cmd_in, in_deps)
 
             # Remove duplicates
-            for dep in [d for d in self.__parse_deps(deps_file) if d not in deps]:
+            for dep in [d for d in in_deps if d not in deps]:
                 deps.append(dep)
 
         return deps
 
+    def get_deps_cache_opts(self, cmd):
+        opts = []
+
+        # Options that only specify where to write dependencies do not affect them
+        opts_it = iter(cmd["opts"])
+        for opt in opts_it:
+            if opt in ("-MF", "-MT", "-MQ"):
+                next(opts_it, None)
+            elif not opt.startswith(("-Wp,-MD,", "-Wp,-MMD,")):
+                opts.append(opt)
+
+        if self.conf.get("CC.with_system_header_files"):
+            opts.append("-M")
+        else:
+            opts.append("-MM")
+
+        return opts
+
+    def __get_intercepted_deps(self, cmd):
+        """Get a list of (target, dependencies) rules written during the build."""
+        rules = []
+
+        deps_file = self.__get_intercepted_deps_file(self.cmds_file, cmd)
+
+        # File is missing if compiler doesn't support dependencies environment variables,
+        # or if the command itself contains -M options
+        if not os.path.isfile(deps_file):
+            return rules
+
+        self.debug("Parsing intercepted dependencies file {!r}".format(deps_file))
+        with open(deps_file, encoding="utf8") as fp:
+            for line in fp:
+                line = line.rstrip(" \\\n")
+
+                if not line:
+                    continue
+
+                if not line.startswith(" "):
+                    target, line = line.split(":", maxsplit=1)
+                    rules.append((target, []))
+
+                # Split with non-escaped space
+                rules[-1][1].extend(shlex.split(line))
+
+        return rules
+
     def __collect_deps(self, cmd_id, cmd, cmd_in):
+        """Execute command that writes dependencies of the input file.
+
+        Returns:
+            Path to the file with dependencies and True if the command succeeded.
+        """
         deps_file = os.path.join(self.temp_dir, "{}-deps.txt".format(cmd_id))
 
         if self.conf.get("CC.with_system_header_files"):
@@ -104,7 +235,7 @@ class CC(Compiler):
             self.debug("Executing command: {!r}".format(
                 " ".join([shlex.quote(x) for x in command]))
             )
-            subprocess.call(
+            r = subprocess.call(
                 command,
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.DEVNULL,
@@ -112,8 +243,9 @@ class CC(Compiler):
             )
         else:
             self.debug("Command does not contain any input files, skipping")
+            r = None
 
-        return deps_file
+        return deps_file, r == 0
 
     def __parse_deps(self, deps_file):
         deps = []
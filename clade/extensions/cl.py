@@ -46,7 +46,9 @@ class CL(Compiler):
             self.dump_bad_cmd_by_id(cmd["id"], parsed_cmd)
             return
 
-        deps = set(self.__get_deps(cmd["id"], parsed_cmd) + parsed_cmd["in"])
+        cache_stats = {"hits": 0, "misses": 0}
+
+        deps = set(self.__get_deps(cmd["id"], parsed_cmd, cache_stats) + parsed_cmd["in"])
         self.debug("Dependencies: {}".format(deps))
         self.dump_deps_by_id(cmd["id"], deps)
 
@@ -58,6 +60,9 @@ class CL(Compiler):
         ) and self.is_a_compilation_command(parsed_cmd):
             self.store_deps_files(deps, parsed_cmd["cwd"])
 
+        if self.deps_cache_dir:
+            return cache_stats
+
     def __parse_opts(self, cmd):
         parsed_cmd = self._get_cmd_dict(cmd)
 
@@ -153,15 +158,42 @@ class CL(Compiler):
 
         return parsed_cmd
 
-    def __get_deps(self, cmd_id, cmd):
+    def __get_deps(self, cmd_id, cmd, cache_stats):
         """Get a list of CL command dependencies."""
+        # Preprocessed files are created together with dependencies,
+        # so the cache can't be used in this case
+        use_cache = self.deps_cache_dir and not self.conf.get("Compiler.preprocess_cmds")
+
         deps = []
         for cmd_in in cmd["in"]:
-            deps_file = self.__collect_deps(cmd_id, cmd, cmd_in)
-            deps.extend(self.__parse_deps(deps_file))
+            if use_cache:
+                in_deps = self.load_deps_from_cache(cmd, cmd_in)
+
+                if in_deps is not None:
+                    cache_stats["hits"] += 1
+                    deps.extend(in_deps)
+                    continue
+
+                cache_stats["misses"] += 1
+
+            deps_file, collected = self.__collect_deps(cmd_id, cmd, cmd_in)
+            in_deps = self.__parse_deps(deps_file)
+            deps.extend(in_deps)
+
+            # Dependencies of a failed command may be incomplete, so they are not cached
+            if use_cache and collected:
+                self.dump_deps_to_cache(cmd, cmd_in, in_deps)
 
         return deps
 
+    def get_deps_cache_opts(self, cmd):
+        # Options that only specify output files do not affect dependencies
+        opts = [
+            opt for opt in cmd["opts"] if not re.search(r"^[/-]F[oadei]", opt)
+        ]
+
+        return opts + self.conf.get("Compiler.extra_preprocessor_opts", [])
+
     def __collect_deps(self, cmd_id, cmd, cmd_in):
         deps_file = os.path.join(self.temp_dir, "{}-deps.txt".format(cmd_id))
 
@@ -195,7 +227,7 @@ class CL(Compiler):
                     )
                 )
 
-        return deps_file
+        return deps_file, not proc.returncode
 
     def __parse_deps(self, deps_file):
         deps = list()
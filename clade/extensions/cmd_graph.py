@@ -28,6 +28,8 @@ class CmdGraph(Extension):
 
     __version__ = "2"
 
+    incremental = True
+
     def __init__(self, work_dir, conf=None):
         conf = conf if conf else dict()
 
@@ -101,17 +103,24 @@ class CmdGraph(Extension):
     @Extension.prepare
     def parse(self, cmds_file):
         cmds = self.load_all_cmds()
-        self.log("Parsing {} commands".format(len(cmds)))
+        new_cmds = [cmd for cmd in cmds if int(cmd["id"]) > self.parsed_id]
+        self.log("Parsing {} commands".format(len(new_cmds)))
 
-        self.normalize_all_paths(cmds)
+        # Paths of previously parsed commands are already normalized
+        self.normalize_all_paths(new_cmds)
 
+        # New commands can use output of the old ones,
+        # so the graph is built from scratch, which is cheap
         for cmd in sorted(cmds, key=lambda x: int(x["id"])):
             self.__add_to_graph(cmd)
 
+        old_graph = self.load_cmd_graph() if self.parsed_id else dict()
+
         self.dump_data(self.graph, self.graph_file)
 
         for cmd_id in self.graph:
-            self.dump_cmd_graph_node(cmd_id)
+            if self.graph[cmd_id] != old_graph.get(cmd_id):
+                self.dump_cmd_graph_node(cmd_id)
 
         if self.graph:
             if self.conf.get("CmdGraph.as_picture"):
@@ -220,3 +229,106 @@ class CmdGraph(Extension):
             )
 
         return self.extensions[ext_name]
+
+
+class CmdGraphIndex:
+    """Queries to the command graph that are answered without its modification.
+
+    Closures of "using" (ancestors) and "used_by" (descendants) lists are
+    computed on demand only for the part of the graph that is reachable
+    from the requested command, and are cached for the next queries.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.__closures = {"using": dict(), "used_by": dict()}
+
+    def get_ancestors(self, cmd_id, cmd_type=None):
+        """Get identifiers of all commands which output is used (possibly indirectly) by the command."""
+        return self.__query("using", cmd_id, cmd_type)
+
+    def get_descendants(self, cmd_id, cmd_type=None):
+        """Get identifiers of all commands that use (possibly indirectly) output of the command."""
+        return self.__query("used_by", cmd_id, cmd_type)
+
+    def get_roots(self, cmd_id, cmd_type=None):
+        """Get identifiers of ancestors of the command that do not use output of other commands."""
+        return [x for x in self.get_ancestors(cmd_id, cmd_type) if not self.graph[x]["using"]]
+
+    def get_leaves(self, cmd_id, cmd_type=None):
+        """Get identifiers of descendants of the command which output is not used by other commands."""
+        return [x for x in self.get_descendants(cmd_id, cmd_type) if not self.graph[x]["used_by"]]
+
+    def __query(self, key, cmd_id, cmd_type):
+        if cmd_id not in self.graph:
+            raise RuntimeError("Can't find {!r} id in the command graph".format(cmd_id))
+
+        closure = self.__closures[key]
+
+        if cmd_id not in closure:
+            update_transitive_closure(self.graph, key, [cmd_id], closure)
+
+        # Identifiers that are not in the graph are skipped by the type filter
+        if cmd_type:
+            return [
+                x for x in closure[cmd_id]
+                if x in self.graph and self.graph[x]["type"] == cmd_type
+            ]
+
+        return list(closure[cmd_id])
+
+
+def get_transitive_closure(graph, key):
+    """Get transitive closure of the relation stored in the "key" list of each graph node.
+
+    Returns:
+        Dictionary with a tuple of identifiers for each node of the graph:
+        nodes from its own list go first, followed by the indirect ones.
+    """
+    closure = dict()
+    update_transitive_closure(graph, key, graph, closure)
+    return closure
+
+
+def update_transitive_closure(graph, key, start_ids, closure):
+    """Add closures of all nodes reachable from start_ids to the closure dictionary.
+
+    Closure of each node is computed only once, in a single iterative pass
+    in reverse topological order, so shared parts of the graph are not
+    traversed again, and deep graphs do not hit the recursion limit.
+    """
+    for start_id in start_ids:
+        if start_id in closure:
+            continue
+
+        stack = [(start_id, iter(graph[start_id][key]))]
+        on_stack = {start_id}
+
+        while stack:
+            cmd_id, next_ids = stack[-1]
+
+            for next_id in next_ids:
+                if next_id not in closure and next_id not in on_stack and next_id in graph:
+                    stack.append((next_id, iter(graph[next_id][key])))
+                    on_stack.add(next_id)
+                    break
+            else:
+                stack.pop()
+                on_stack.discard(cmd_id)
+
+                # Order of identifiers is kept, and duplicates are removed
+                cmd_closure = []
+                seen = {cmd_id}
+                for next_id in graph[cmd_id][key]:
+                    if next_id not in seen:
+                        seen.add(next_id)
+                        cmd_closure.append(next_id)
+
+                for next_id in graph[cmd_id][key]:
+                    # Closure of the node is incomplete if the graph contains a cycle
+                    for closure_id in closure.get(next_id, ()):
+                        if closure_id not in seen:
+                            seen.add(closure_id)
+                            cmd_closure.append(closure_id)
+
+                closure[cmd_id] = tuple(cmd_closure)
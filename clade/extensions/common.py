@@ -40,6 +40,8 @@ class Common(Extension, metaclass=abc.ABCMeta):
 
     __version__ = "1"
 
+    incremental = True
+
     def __init__(self, work_dir, conf=None):
         super().__init__(work_dir, conf)
 
@@ -70,15 +72,20 @@ class Common(Extension, metaclass=abc.ABCMeta):
     def parse(self, cmds_file, which_list):
         """Multiprocess parsing of build commands filtered by 'which' field."""
 
-        total_cmds = number_of_cmds_by_which(cmds_file, which_list)
-        cmds = iter_cmds_by_which(cmds_file, which_list)
-        self.parse_cmds_in_parallel(cmds, unwrap, total_cmds=total_cmds)
+        total_cmds = number_of_cmds_by_which(cmds_file, which_list, after_id=self.parsed_id)
+        cmds = iter_cmds_by_which(cmds_file, which_list, after_id=self.parsed_id)
+        results = self.parse_cmds_in_parallel(cmds, unwrap, total_cmds=total_cmds)
+        self.process_results(results)
 
         self.__merge_all_cmds()
 
         if os.path.exists(self.temp_dir):
             shutil.rmtree(self.temp_dir)
 
+    def process_results(self, results):
+        """Process values returned by parse_cmd() in child processes."""
+        return
+
     def __terminate_workers(self, cmds_queue, cmd_workers, cmd_workers_num):
         # Terminate all workers.
         for i in range(cmd_workers_num):
@@ -188,6 +195,14 @@ class Common(Extension, metaclass=abc.ABCMeta):
 
         merged_cmds = []
 
+        # Commands parsed during the previous launch are already merged
+        if self.parsed_id:
+            merged_cmds = self.load_data("cmds.json", raise_exception=False) or []
+            cmd_jsons = [
+                f for f in cmd_jsons
+                if int(os.path.splitext(os.path.basename(f))[0]) > self.parsed_id
+            ]
+
         for cmd_json in cmd_jsons:
             parsed_cmd = self.load_data(cmd_json)
             merged_cmds.append(parsed_cmd)
@@ -13,7 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os
+import shutil
+import tempfile
+import ujson
 
 from clade.extensions.common import Common
 
@@ -27,6 +31,116 @@ class Compiler(Common):
 
     __version__ = "1"
 
+    def __init__(self, work_dir, conf=None):
+        super().__init__(work_dir, conf)
+
+        # Directory with cached dependencies, shared between working directories
+        self.deps_cache_dir = self.conf.get("Compiler.deps_cache_dir")
+        if self.deps_cache_dir:
+            self.deps_cache_dir = os.path.abspath(self.deps_cache_dir)
+
+        self.__compiler_ids = dict()
+        self.__file_hashes = dict()
+
+    def process_results(self, results):
+        if not self.deps_cache_dir:
+            return
+
+        self.ext_meta["cache"] = {
+            "hits": sum(r["hits"] for r in results),
+            "misses": sum(r["misses"] for r in results),
+        }
+        self.log("Dependencies cache: {} hits, {} misses".format(
+            self.ext_meta["cache"]["hits"], self.ext_meta["cache"]["misses"]
+        ))
+
+    def get_deps_cache_opts(self, cmd):
+        """Get options of the command that affect its dependencies."""
+        return cmd["opts"]
+
+    def load_deps_from_cache(self, cmd, cmd_in):
+        """Load dependencies of the input file from the cache.
+
+        Returns None, if there is no cache entry, or if any of the cached
+        dependencies was changed since the entry was stored.
+        """
+        cache_entry = self.__get_deps_cache_entry(cmd, cmd_in)
+
+        try:
+            with open(cache_entry, "r") as fh:
+                cached_deps = ujson.load(fh)
+        except (OSError, ValueError):
+            return None
+
+        for dep, dep_hash in cached_deps:
+            if self.__get_file_hash(os.path.join(cmd["cwd"], dep)) != dep_hash:
+                self.debug("Cached dependency was changed: {!r}".format(dep))
+                return None
+
+        self.debug("Load dependencies from the cache: {!r}".format(cache_entry))
+        return [dep for dep, _ in cached_deps]
+
+    def dump_deps_to_cache(self, cmd, cmd_in, deps):
+        cache_entry = self.__get_deps_cache_entry(cmd, cmd_in)
+        os.makedirs(os.path.dirname(cache_entry), exist_ok=True)
+
+        cached_deps = [
+            (dep, self.__get_file_hash(os.path.join(cmd["cwd"], dep))) for dep in deps
+        ]
+
+        # Cache entry appears atomically, even if several
+        # processes are trying to store it simultaneously
+        fd, tmp_entry = tempfile.mkstemp(dir=os.path.dirname(cache_entry))
+        with os.fdopen(fd, "w") as fh:
+            ujson.dump(cached_deps, fh)
+
+        os.replace(tmp_entry, cache_entry)
+
+    def __get_deps_cache_entry(self, cmd, cmd_in):
+        key = [
+            self.name,
+            self.get_ext_version(),
+            self.__get_compiler_id(cmd["command"][0], cmd["cwd"]),
+            self.get_deps_cache_opts(cmd),
+            cmd["cwd"],
+            cmd_in,
+            self.__get_file_hash(os.path.join(cmd["cwd"], cmd_in)),
+        ]
+
+        cache_key = hashlib.md5(ujson.dumps(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.deps_cache_dir, cache_key[:2], cache_key + ".json")
+
+    def __get_compiler_id(self, compiler, cwd):
+        """Get path, version and modification time of the compiler."""
+        if os.path.dirname(compiler):
+            compiler = os.path.join(cwd, compiler)
+        else:
+            compiler = shutil.which(compiler) or compiler
+
+        if compiler not in self.__compiler_ids:
+            try:
+                stat = os.stat(compiler)
+                self.__compiler_ids[compiler] = [
+                    compiler,
+                    self.get_program_version(compiler),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ]
+            except OSError:
+                self.__compiler_ids[compiler] = [compiler]
+
+        return self.__compiler_ids[compiler]
+
+    def __get_file_hash(self, file):
+        if file not in self.__file_hashes:
+            try:
+                with open(file, "rb") as fh:
+                    self.__file_hashes[file] = hashlib.md5(fh.read()).hexdigest()
+            except OSError:
+                self.__file_hashes[file] = None
+
+        return self.__file_hashes[file]
+
     def store_deps_files(self, deps, cwd):
         self.__store_src_files(deps, cwd, self.conf.get("Compiler.deps_encoding"))
 
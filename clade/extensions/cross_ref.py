@@ -13,7 +13,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import codecs
 import os
 import re
 
@@ -44,6 +43,15 @@ class CrossRef(Callgraph):
         self.log("Calculating raw locations")
         raw_locations = self.__get_raw_locations()
 
+        # There may be some header files from CIF that are not in the storage
+        storage = self.extensions["Storage"]
+        storage.add_files(
+            [
+                file for file in raw_locations
+                if not storage.file_exists(file) and os.path.exists(file)
+            ]
+        )
+
         self.log("Parsing files")
         locations = dict()
         for file in raw_locations:
@@ -55,6 +63,9 @@ class CrossRef(Callgraph):
         self.log("Calculating 'from' references")
         self.__gen_ref_from(locations)
 
+        self.funcs = None
+        self.strings.clear()
+
         self.log("Calculating finished")
 
     def load_ref_to_by_file(self, files=None):
@@ -74,11 +85,13 @@ class CrossRef(Callgraph):
         return raw_locations
 
     def __get_raw_func_locations(self, raw_locations):
+        intern = self.strings.intern
+
         for file, func in traverse(self.funcs, 2):
             def_line = self.funcs[file][func]["line"]
 
             if def_line:
-                val = (def_line, func, "def_func")
+                val = (intern(def_line), intern(func), "def_func")
 
                 if file in raw_locations:
                     raw_locations[file].append(val)
@@ -88,7 +101,8 @@ class CrossRef(Callgraph):
             for decl_file in self.funcs[file][func]["declarations"]:
                 decl_line = self.funcs[file][func]["declarations"][decl_file]["line"]
 
-                val = (decl_line, func, "decl_func")
+                decl_file = intern(decl_file)
+                val = (intern(decl_line), intern(func), "decl_func")
 
                 if decl_file in raw_locations:
                     raw_locations[decl_file].append(val)
@@ -96,8 +110,10 @@ class CrossRef(Callgraph):
                     raw_locations[decl_file] = [val]
 
         for context_file, callgraph in self.extensions["Callgraph"].yield_callgraph():
+            context_file = intern(context_file)
+
             for _, _, file, func, line in traverse(callgraph[context_file], 5, {2: "calls"}):
-                val = (line, func, "call")
+                val = (intern(line), intern(func), "call")
 
                 if context_file in raw_locations:
                     raw_locations[context_file].append(val)
@@ -107,9 +123,13 @@ class CrossRef(Callgraph):
         return raw_locations
 
     def __get_raw_macro_locations(self, raw_locations):
+        intern = self.strings.intern
+
         for exp_file, expansions in self.extensions["Macros"].yield_expansions():
+            exp_file = intern(exp_file)
+
             for macro, exp_line in traverse(expansions[exp_file], 2):
-                val = (exp_line, macro, "expand")
+                val = (intern(exp_line), intern(macro), "expand")
 
                 if exp_file in raw_locations:
                     raw_locations[exp_file].append(val)
@@ -118,11 +138,13 @@ class CrossRef(Callgraph):
 
         # Load macros dictionary independetly for each file
         for def_file, macros in self.extensions["Macros"].yield_macros():
+            def_file = intern(def_file)
+
             for macro, def_line in traverse(macros[def_file], 2):
                 if def_file == "unknown":
                     continue
 
-                val = (def_line, macro, "def_macro")
+                val = (intern(def_line), intern(macro), "def_macro")
 
                 if def_file in raw_locations:
                     raw_locations[def_file].append(val)
@@ -132,14 +154,10 @@ class CrossRef(Callgraph):
         return raw_locations
 
     def __parse_file(self, file, raw_locations, ignore_errors=False, encoding="utf8"):
-        storage_file = self.extensions["Storage"].get_storage_path(file)
+        storage = self.extensions["Storage"]
 
-        if not os.path.exists(storage_file):
-            # There may be some header files from CIF that are not in the storage
-            if os.path.exists(file):
-                self.extensions["Storage"].add_file(file)
-            else:
-                return None
+        if not storage.file_exists(file):
+            return None
 
         locations = nested_dict()
 
@@ -148,9 +166,9 @@ class CrossRef(Callgraph):
 
         try:
             if ignore_errors:
-                fp = codecs.open(storage_file, "r", encoding=encoding, errors="ignore")
+                fp = storage.open_file(file, encoding=encoding, errors="ignore")
             else:
-                fp = open(storage_file, "r", encoding=encoding)
+                fp = storage.open_file(file, encoding=encoding)
 
             for i, s in enumerate(fp):
                 if sorted_pos >= len(sorted_locs):
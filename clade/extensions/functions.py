@@ -26,8 +26,6 @@ class Functions(Callgraph):
     def __init__(self, work_dir, conf=None):
         super().__init__(work_dir, conf)
 
-        self.src_graph = dict()
-
         self.funcs = nested_dict()
         self.funcs_file = "functions.json"
 
@@ -37,7 +35,7 @@ class Functions(Callgraph):
 
     @Extension.prepare
     def parse(self, cmds_file):
-        self.src_graph = self.extensions["SrcGraph"].load_src_graph()
+        self._load_src_graph()
 
         self.log("Parsing function definitions and declarations")
         self.__process_definitions()
@@ -50,9 +48,10 @@ class Functions(Callgraph):
         self.dump_data(self.funcs_by_file, self.funcs_by_file_file)
         self.dump_data_by_key(self.funcs_by_file, self.funcs_by_file_folder)
 
-        self.src_graph.clear()
+        self._clear_src_graph()
         self.funcs.clear()
         self.funcs_by_file.clear()
+        self.strings.clear()
 
         self.log("Parsing finished")
 
@@ -68,7 +67,11 @@ class Functions(Callgraph):
             return self.load_data(self.funcs_by_file_file)
 
     def __process_definitions(self):
+        intern = self.strings.intern
+
         for src_file, func, def_line, func_type, signature in self.extensions["Info"].iter_definitions():
+            src_file, func, def_line, func_type = map(intern, (src_file, func, def_line, func_type))
+
             if func in self.funcs and src_file in self.funcs[func]:
                 self._error(
                     "Function is defined more than once: {!r} {!r}".format(
@@ -93,7 +96,13 @@ class Functions(Callgraph):
                 "declarations": {decl_file: decl_val},
             }
 
+        intern = self.strings.intern
+
         for decl_file, decl_name, decl_line, decl_type, decl_signature in self.extensions["Info"].iter_declarations():
+            decl_file, decl_name, decl_line, decl_type, decl_signature = map(
+                intern, (decl_file, decl_name, decl_line, decl_type, decl_signature)
+            )
+
             decl_val = {
                 "signature": decl_signature,
                 "line": decl_line,
@@ -106,13 +115,13 @@ class Functions(Callgraph):
                 )
                 continue
 
-            if decl_file not in self.src_graph:
+            if decl_file not in self.compiled_in_sets:
                 self._error("Not in source graph: {}".format(decl_file))
 
             found = False
 
             for src_file in self.funcs[decl_name]:
-                if src_file not in self.src_graph:
+                if src_file not in self.compiled_in_sets:
                     self._error("Not in source graph: {}".format(src_file))
 
                 if (
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import array
 import codecs
 import concurrent.futures
 import fnmatch
@@ -22,13 +23,41 @@ import os
 import re
 import shlex
 import shutil
+import struct
 import subprocess
 import sys
+import tempfile
 import time
+import ujson
 
 from clade.extensions.abstract import Extension
 from clade.extensions.opts import filter_opts
 
+# Placeholder for the path to the Storage directory in the cached CIF output
+CACHE_STORAGE = "CLADE-STORAGE"
+
+# Regular expressions that split lines of joined CIF output files into fields
+RECORD_PATTERNS = {
+    "execution.txt": r"\"(.*?)\" (\S*) (\S*) (\S*) ([^']*)\n",
+    "declare_func.txt": r"\"(.*?)\" (\S*) (\S*) (\S*) ([^']*)\n",
+    "exported.txt": r"\"(.*?)\" (\S*)",
+    "call.txt": r'\"(.*?)\" (\S*) (\S*) (\S*) (\S*) (.*)',
+    "callp.txt": r'\"(.*?)\" (\S*) (\S*) (\S*)',
+    "use_func.txt": r'\"(.*?)\" (\S*) (\S*) (\S*)',
+    "define.txt": r"\"(.*?)\" (\S*) (\S*)",
+    "expand.txt": r'\"(.*?)\" \"(.*?)\" (\S*) (\S*) (\S*)(.*)',
+    "typedefs.txt": r'\"(.*?)\" typedef (.*)',
+}
+
+# Header of the binary records file: magic, version, number of columns,
+# size of the text file it was converted from, offset of the string table
+RECORDS_HEADER = struct.Struct("<4sHHQQ")
+RECORDS_MAGIC = b"CLDR"
+RECORDS_VERSION = 1
+# Each chunk of records starts with the number of rows in it
+RECORDS_CHUNK = struct.Struct("<I")
+RECORDS_CHUNK_SIZE = 65536
+
 
 class Info(Extension):
     always_requires = ["SrcGraph", "Path", "Storage"]
@@ -36,6 +65,8 @@ class Info(Extension):
 
     __version__ = "2"
 
+    incremental = True
+
     def __init__(self, work_dir, conf=None):
         if not conf:
             conf = dict()
@@ -98,6 +129,15 @@ class Info(Extension):
 
         self.expand_regex = re.compile(r'\"(.*?)\"(.*)')
 
+        # Directory with cached CIF output, shared between working directories
+        self.cache_dir = self.conf.get("Info.cache_dir")
+        if self.cache_dir:
+            self.cache_dir = os.path.abspath(self.cache_dir)
+
+        # Hash of everything that affects CIF output, except the command itself
+        self.cache_base_key = None
+        self.__file_hashes = dict()
+
     @Extension.prepare
     def parse(self, cmds_file):
         if not shutil.which(self.conf.get("Info.cif", "cif")):
@@ -115,7 +155,27 @@ class Info(Extension):
         if not cmds:
             raise RuntimeError("There are no parsed compiler commands")
 
-        self.parse_cmds_in_parallel(cmds, Info._run_cif)
+        # Output of CIF for previously parsed commands is already normalized
+        if self.parsed_id:
+            cmds = [cmd for cmd in cmds if int(cmd["id"]) > self.parsed_id]
+
+            if not cmds:
+                self.log("There are no new compiler commands")
+                return
+
+        if self.cache_dir:
+            self.cache_base_key = self.__get_cache_base_key()
+
+        results = self.parse_cmds_in_parallel(cmds, Info._run_cif)
+
+        if self.cache_dir:
+            self.ext_meta["cache"] = {
+                "hits": sum(r["hits"] for r in results),
+                "misses": sum(r["misses"] for r in results),
+            }
+            self.log("CIF cache: {} hits, {} misses".format(
+                self.ext_meta["cache"]["hits"], self.ext_meta["cache"]["misses"]
+            ))
 
         if os.path.exists(self.temp_dir):
             shutil.rmtree(self.temp_dir)
@@ -146,6 +206,8 @@ class Info(Extension):
         tmp_dir = os.path.join(self.temp_dir, str(os.getpid()))
         os.makedirs(tmp_dir, exist_ok=True)
 
+        cache_stats = {"hits": 0, "misses": 0}
+
         # If True then  CIF will be executed on preprocessed .i file
         use_pre = self.conf.get("Compiler.preprocess_cmds") and self.conf.get(
             "Info.use_preprocessed_files"
@@ -206,10 +268,25 @@ class Info(Extension):
                 cif_args.append("--")
                 cif_args.extend(opts)
 
-            cwd = self.extensions["Path"].get_abs_path(cmd["cwd"])
-            cwd = self.extensions["Storage"].get_storage_path(cwd)
+            norm_cwd = self.extensions["Path"].get_abs_path(cmd["cwd"])
+            cwd = self.extensions["Storage"].get_storage_path(norm_cwd)
             os.makedirs(cwd, exist_ok=True)
 
+            cache_key = None
+            if self.cache_dir:
+                cache_key = self.__get_cache_key(cmd, cif_in, norm_cmd_in, norm_cwd, opts)
+
+                if self.__load_cif_output_from_cache(cache_key):
+                    cache_stats["hits"] += 1
+                    output = "CIF output is taken from the cache: {}".format(cache_key)
+                    self.__save_log(cmd["id"], cwd, cif_args, cif_env, output, self.cif_log)
+                    continue
+
+                cache_stats["misses"] += 1
+
+                # Output of each CIF launch must be stored separately
+                cif_env["CIF_INFO_DIR"] = tempfile.mkdtemp(dir=tmp_dir)
+
             try:
                 self.debug(cif_args)
                 output = subprocess.check_output(
@@ -220,14 +297,122 @@ class Info(Extension):
                     env=os.environ.update(cif_env)
                 )
                 self.__save_log(cmd["id"], cwd, cif_args, cif_env, output, self.cif_log)
+                failed = False
             except subprocess.CalledProcessError as e:
                 self.__save_log(cmd["id"], cwd, cif_args, cif_env, e.output, self.err_log)
                 self.__save_log(cmd["id"], cwd, cif_args, cif_env, e.output, self.cif_log)
-                return
+                failed = True
+
+            if cache_key:
+                # Output of failed CIF launches is not cached
+                self.__save_cif_output(
+                    cif_env["CIF_INFO_DIR"], cache_key if not failed else None
+                )
+
+            if failed:
+                break
 
         # Force garbage collector to work
         gc.collect()
 
+        if self.cache_dir:
+            return cache_stats
+
+    def __get_cache_base_key(self):
+        cif = self.conf.get("Info.cif", "cif")
+
+        h = hashlib.md5()
+        h.update(self.get_ext_version().encode("utf-8"))
+        h.update(self.get_program_version(cif).encode("utf-8"))
+        h.update(self.__get_file_hash(self.aspect).encode("utf-8"))
+
+        aspectator = self.conf.get("Info.aspectator")
+        if aspectator:
+            h.update(self.get_program_version(aspectator).encode("utf-8"))
+
+        return h.hexdigest()
+
+    def __get_cache_key(self, cmd, cif_in, norm_cmd_in, norm_cwd, opts):
+        """Get key of the CIF output in the cache.
+
+        Key does not depend on the location of the working directory.
+        """
+        storage = self.extensions["Storage"].get_storage_dir()
+
+        deps = []
+        for dep in self.extensions[cmd["type"]].load_deps_by_id(cmd["id"]):
+            norm_dep = self.extensions["Path"].get_rel_path(dep, cmd["cwd"])
+            deps.append((norm_dep, self.__get_storage_file_hash(norm_dep)))
+
+        key = [
+            self.cache_base_key,
+            norm_cmd_in,
+            norm_cwd,
+            cif_in.replace(storage, CACHE_STORAGE),
+            self.__get_file_hash(cif_in),
+            sorted(deps),
+            [opt.replace(storage, CACHE_STORAGE) for opt in opts],
+        ]
+
+        return hashlib.md5(ujson.dumps(key).encode("utf-8")).hexdigest()
+
+    def __get_file_hash(self, file):
+        if file not in self.__file_hashes:
+            try:
+                with open(file, "rb") as fh:
+                    self.__file_hashes[file] = hashlib.md5(fh.read()).hexdigest()
+            except OSError:
+                self.__file_hashes[file] = None
+
+        return self.__file_hashes[file]
+
+    def __get_storage_file_hash(self, file):
+        storage_file = self.extensions["Storage"].get_storage_path(file)
+
+        if storage_file not in self.__file_hashes:
+            try:
+                content = self.extensions["Storage"].read_file(file, mode="rb")
+                self.__file_hashes[storage_file] = hashlib.md5(content).hexdigest()
+            except OSError:
+                self.__file_hashes[storage_file] = None
+
+        return self.__file_hashes[storage_file]
+
+    def __get_cache_entry(self, cache_key):
+        return os.path.join(self.cache_dir, cache_key[:2], cache_key)
+
+    def __load_cif_output_from_cache(self, cache_key):
+        cache_entry = self.__get_cache_entry(cache_key)
+
+        if not os.path.isdir(cache_entry):
+            return False
+
+        self.debug("Load CIF output from the cache: {!r}".format(cache_entry))
+        storage = self.extensions["Storage"].get_storage_dir().lstrip(os.sep)
+        copy_cif_output(cache_entry, self.cif_output_dir, CACHE_STORAGE, storage)
+        return True
+
+    def __save_cif_output(self, output_dir, cache_key=None):
+        """Move output of a single CIF launch to the common output directory."""
+        storage = self.extensions["Storage"].get_storage_dir().lstrip(os.sep)
+
+        if cache_key and not os.path.isdir(self.__get_cache_entry(cache_key)):
+            cache_entry = self.__get_cache_entry(cache_key)
+            os.makedirs(os.path.dirname(cache_entry), exist_ok=True)
+
+            # Cache entry appears atomically, even if several
+            # processes are trying to store it simultaneously
+            tmp_entry = tempfile.mkdtemp(dir=os.path.dirname(cache_entry))
+            copy_cif_output(output_dir, tmp_entry, storage, CACHE_STORAGE)
+
+            try:
+                os.rename(tmp_entry, cache_entry)
+            except OSError:
+                shutil.rmtree(tmp_entry)
+
+        copy_cif_output(output_dir, self.cif_output_dir)
+        shutil.rmtree(output_dir)
+
     def __is_cmd_bad_for_cif(self, cmd):
         if not cmd["in"]:
             return True
@@ -262,7 +447,7 @@ class Info(Extension):
     def __find_cif_output(self):
         cif_output = []
 
-        for root, _, filenames in os.walk(self.work_dir):
+        for root, _, filenames in os.walk(self.cif_output_dir):
             for filename in fnmatch.filter(filenames, "*.txt"):
                 cif_output.append(os.path.join(root, filename))
 
@@ -270,44 +455,51 @@ class Info(Extension):
 
     def __normalize_cif_output(self, cif_output):
         self.log("Normalizing CIF output")
+        time_start = time.time()
 
         if self.conf.get("cpu_count"):
             max_workers = self.conf.get("cpu_count", os.cpu_count())
         else:
             max_workers = os.cpu_count()
 
+        init_global = os.path.basename(self.init_global)
+        files = [f for f in cif_output if not f.endswith(init_global)]
+        total_files = len(files)
+
+        storage = self.extensions["Storage"].get_storage_dir()
+        expand = os.path.basename(self.expand)
+
+        show_progress = total_files and sys.stdout.isatty() and self.conf["log_level"] in ["INFO", "DEBUG"]
+
         # Normalize all small cif output files
         with concurrent.futures.ProcessPoolExecutor(
             max_workers=max_workers
         ) as p:
-            futures = []
+            # Most files are small, so they are normalized in batches
+            batch_size = max(1, min(100, total_files // (max_workers * 8)))
+            futures = [
+                p.submit(normalize_files, files[i:i + batch_size], storage, self.cif_output_dir, expand)
+                for i in range(0, total_files, batch_size)
+            ]
             finished_files = 0
 
-            init_global = os.path.basename(self.init_global)
-            files = [f for f in cif_output if not f.endswith(init_global)]
-            total_files = len(files)
-
-            storage = self.extensions["Storage"].get_storage_dir()
-            expand = os.path.basename(self.expand)
-
-            for file in files:
-                f = p.submit(normalize_file, file, storage, self.cif_output_dir, expand)
-                futures.append(f)
-
-            while True:
-                if not futures:
-                    break
+            for f in concurrent.futures.as_completed(futures):
+                try:
+                    finished_files += f.result()
+                except Exception as e:
+                    self.error(
+                        "Something happened in the child process: {}".format(
+                            e
+                        )
+                    )
 
-                done_futures = [x for x in futures if x.done()]
+                    for future in futures:
+                        future.cancel()
 
-                # Remove all futures that are already completed
-                # to reduce memory usage
-                futures = [x for x in futures if not x.done()]
+                    raise RuntimeError
 
                 # Track progress (only if stdout is not redirected)
-                if total_files and sys.stdout.isatty() and self.conf["log_level"] in ["INFO", "DEBUG"]:
-                    finished_files += len(done_futures)
-
+                if show_progress:
                     msg = "\t [{:.0f}%] {} of {} files are normalized".format(
                         finished_files / total_files * 100,
                         finished_files,
@@ -315,71 +507,76 @@ class Info(Extension):
                     )
                     print(msg, end="\r")
 
-                # Check return value of all finished futures
-                for f in done_futures:
-                    try:
-                        f.result()
-                    except Exception as e:
-                        self.error(
-                            "Something happened in the child process: {}".format(
-                                e
-                            )
-                        )
-
-                        raise RuntimeError
-
-                # Save a little bit of CPU time
-                time.sleep(0.1)
-
-        if total_files and sys.stdout.isatty() and self.conf["log_level"] in ["INFO", "DEBUG"]:
+        if show_progress:
             print(" " * 79, end="\r")
 
+        self.log("Normalizing took {:.2f} seconds".format(time.time() - time_start))
+        time_start = time.time()
+
         # Join all cif output file into several big .txt files
-        for file in self.files:
-            output_type = os.path.basename(file)
+        output_files = dict()
+        for output_file in cif_output:
+            output_files.setdefault(os.path.basename(output_file), []).append(output_file)
+
+        # Each big file is written by a separate thread
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as p:
+            futures = [
+                p.submit(join_files, output_files.get(os.path.basename(file), []), file)
+                for file in self.files
+            ]
 
-            for output_file in [f for f in cif_output if f.endswith(output_type)]:
-                with open(file, "a") as file_fh:
-                    with open(output_file, "r") as output_fh:
-                        # This files should be fairly small
-                        file_fh.write(output_fh.read())
+            for f in futures:
+                f.result()
+
+        self.log("Joining took {:.2f} seconds".format(time.time() - time_start))
 
         # Remove cif output directory
         shutil.rmtree(self.cif_output_dir)
 
+        self.__convert_cif_output(max_workers)
+
         self.log("Normalizing finished")
 
+    def __convert_cif_output(self, max_workers):
+        """Convert joined CIF output into binary records read by iter_* methods."""
+        time_start = time.time()
+
+        files = [f for f in self.files if os.path.basename(f) in RECORD_PATTERNS]
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as p:
+            futures = {
+                p.submit(convert_to_records, file, RECORD_PATTERNS[os.path.basename(file)]): file
+                for file in files
+            }
+
+            for f in concurrent.futures.as_completed(futures):
+                # Such files will be parsed by regular expressions on each iteration
+                if not f.result():
+                    self.warning("Can't convert {!r} to binary records".format(futures[f]))
+
+        self.log("Converting took {:.2f} seconds".format(time.time() - time_start))
+
     def iter_definitions(self):
         """Yield src_file, func, def_line, func_type, signature"""
 
-        regex = re.compile(r"\"(.*?)\" (\S*) (\S*) (\S*) ([^']*)\n")
-
-        for content in self.__iter_file_regex(self.execution, regex):
-            yield content
+        yield from self.__iter_records(self.execution)
 
     def iter_declarations(self):
         """Yield decl_file, decl_name, decl_line, decl_type, decl_signature"""
 
-        regex = re.compile(r"\"(.*?)\" (\S*) (\S*) (\S*) ([^']*)\n")
-
-        for content in self.__iter_file_regex(self.decl, regex):
-            yield content
+        yield from self.__iter_records(self.decl)
 
     def iter_exported(self):
         """Yield src_file, func"""
 
-        regex = re.compile(r"\"(.*?)\" (\S*)")
-
-        for content in self.__iter_file_regex(self.exported, regex):
-            yield content
+        yield from self.__iter_records(self.exported)
 
     def iter_calls(self):
         """Yield context_file, context_func, func, call_line, call_type, args"""
 
-        regex = re.compile(r'\"(.*?)\" (\S*) (\S*) (\S*) (\S*) (.*)')
         args_regex = re.compile(r"actual_arg_func_name(\d+)=\s*(\w+)\s*")
 
-        for content in self.__iter_file_regex(self.call, regex):
+        for content in self.__iter_records(self.call):
             content = list(content)
 
             # Last element should be args
@@ -390,34 +587,24 @@ class Info(Extension):
     def iter_calls_by_pointers(self):
         """Yield context_file, context_func, func_ptr, call_line"""
 
-        regex = re.compile(r'\"(.*?)\" (\S*) (\S*) (\S*)')
-
-        for content in self.__iter_file_regex(self.callp, regex):
-            yield content
+        yield from self.__iter_records(self.callp)
 
     def iter_functions_usages(self):
         """Yield context_file, context_func, func, line"""
 
-        regex = re.compile(r'\"(.*?)\" (\S*) (\S*) (\S*)')
-
-        for content in self.__iter_file_regex(self.use_func, regex):
-            yield content
+        yield from self.__iter_records(self.use_func)
 
     def iter_macros_definitions(self):
         """Yield file, macro, line"""
 
-        regex = re.compile(r"\"(.*?)\" (\S*) (\S*)")
-
-        for content in self.__iter_file_regex(self.define, regex):
-            yield content
+        yield from self.__iter_records(self.define)
 
     def iter_macros_expansions(self):
         """Yield exp_file, def_file, macro, exp_line, def_line, args_str"""
 
-        regex = re.compile(r'\"(.*?)\" \"(.*?)\" (\S*) (\S*) (\S*)(.*)')
         arg_regex = re.compile(r' actual_arg\d+=(.*)')
 
-        for content in self.__iter_file_regex(self.expand, regex):
+        for content in self.__iter_records(self.expand):
             content = list(content)
 
             args = list()
@@ -436,10 +623,16 @@ class Info(Extension):
     def iter_typedefs(self):
         """Yeild scope_file, declaration"""
 
-        regex = re.compile(r'\"(.*?)\" typedef (.*)')
+        yield from self.__iter_records(self.typedefs)
 
-        for content in self.__iter_file_regex(self.typedefs, regex):
-            yield content
+    def __iter_records(self, file):
+        records_file = get_records_file(file)
+
+        if records_file:
+            yield from iter_records(records_file)
+        else:
+            regex = re.compile(RECORD_PATTERNS[os.path.basename(file)])
+            yield from self.__iter_file_regex(file, regex)
 
     def __iter_file_regex(self, file, regex):
         for line in self.__iter_file(file):
@@ -460,6 +653,171 @@ class Info(Extension):
                 yield line
 
 
+def copy_cif_output(src_dir, dst_dir, old=None, new=None):
+    """Append content of all CIF output files from src_dir to dst_dir.
+
+    If old and new are specified, all occurrences of old
+    are replaced by new both in paths and in content of files.
+    """
+    for root, _, filenames in os.walk(src_dir):
+        for filename in filenames:
+            file = os.path.join(root, filename)
+            rel_file = os.path.relpath(file, src_dir)
+
+            with open(file, "rb") as fh:
+                content = fh.read()
+
+            if old:
+                rel_file = rel_file.replace(old, new)
+                content = content.replace(old.encode("utf-8"), new.encode("utf-8"))
+
+            dst_file = os.path.join(dst_dir, rel_file)
+            os.makedirs(os.path.dirname(dst_file), exist_ok=True)
+
+            # Several processes can append to the same file simultaneously
+            with open(dst_file, "ab") as fh:
+                fh.write(content)
+
+
+def join_files(files, dst_file):
+    """Append content of all files to a single destination file."""
+    if not files:
+        return
+
+    with open(dst_file, "ab") as dst_fh:
+        for file in files:
+            with open(file, "rb") as src_fh:
+                shutil.copyfileobj(src_fh, dst_fh)
+
+
+def convert_to_records(file, pattern):
+    """Convert text file into binary records.
+
+    Each line of the file is split into fields by the regular expression.
+    Unique field values are stored once in the string table at the end
+    of the records file, and records themselves are stored as chunks of
+    fixed-width integer columns with indexes in this table.
+
+    Returns False if some line of the file does not match the pattern.
+    """
+    records_file = os.path.splitext(file)[0] + ".bin"
+
+    # Outdated records must not be used instead of the text file
+    if os.path.exists(records_file):
+        os.remove(records_file)
+
+    if not os.path.isfile(file):
+        return True
+
+    regex = re.compile(pattern)
+    text_size = os.path.getsize(file)
+    strings = dict()
+    tmp_file = records_file + ".tmp"
+
+    with open(file, "r") as fh, open(tmp_file, "wb") as records_fh:
+        records_fh.write(RECORDS_HEADER.pack(b"", 0, 0, 0, 0))
+
+        columns = [array.array("I") for _ in range(regex.groups)]
+
+        for line in fh:
+            m = regex.match(line)
+
+            if not m:
+                records_fh.close()
+                os.remove(tmp_file)
+                return False
+
+            for column, value in zip(columns, m.groups()):
+                column.append(strings.setdefault(value, len(strings)))
+
+            if len(columns[0]) >= RECORDS_CHUNK_SIZE:
+                write_records_chunk(records_fh, columns)
+
+        write_records_chunk(records_fh, columns)
+
+        # Zero byte separates strings in the table
+        if any("\0" in s for s in strings):
+            records_fh.close()
+            os.remove(tmp_file)
+            return False
+
+        strings_offset = records_fh.tell()
+        records_fh.write("\0".join(strings).encode("utf-8"))
+
+        records_fh.seek(0)
+        records_fh.write(
+            RECORDS_HEADER.pack(
+                RECORDS_MAGIC, RECORDS_VERSION, regex.groups, text_size, strings_offset
+            )
+        )
+
+    os.replace(tmp_file, records_file)
+    return True
+
+
+def write_records_chunk(fh, columns):
+    if not columns or not columns[0]:
+        return
+
+    fh.write(RECORDS_CHUNK.pack(len(columns[0])))
+
+    for column in columns:
+        column.tofile(fh)
+        del column[:]
+
+
+def get_records_file(file):
+    """Get path to the binary records of the text file, if they are up to date."""
+    records_file = os.path.splitext(file)[0] + ".bin"
+
+    try:
+        with open(records_file, "rb") as fh:
+            header = fh.read(RECORDS_HEADER.size)
+        text_size = os.path.getsize(file)
+    except OSError:
+        return None
+
+    if len(header) != RECORDS_HEADER.size:
+        return None
+
+    magic, version, _, records_text_size, _ = RECORDS_HEADER.unpack(header)
+
+    if magic != RECORDS_MAGIC or version != RECORDS_VERSION or records_text_size != text_size:
+        return None
+
+    return records_file
+
+
+def iter_records(records_file):
+    """Yield tuples of fields stored in the binary records file."""
+    with open(records_file, "rb") as fh:
+        _, _, n_columns, _, strings_offset = RECORDS_HEADER.unpack(
+            fh.read(RECORDS_HEADER.size)
+        )
+
+        fh.seek(strings_offset)
+        strings = fh.read().decode("utf-8").split("\0")
+        fh.seek(RECORDS_HEADER.size)
+
+        while fh.tell() < strings_offset:
+            rows = RECORDS_CHUNK.unpack(fh.read(RECORDS_CHUNK.size))[0]
+
+            columns = []
+            for _ in range(n_columns):
+                column = array.array("I")
+                column.fromfile(fh, rows)
+                columns.append(map(strings.__getitem__, column))
+
+            yield from zip(*columns)
+
+
+def normalize_files(files, storage, cif_output_dir, expand):
+    for file in files:
+        normalize_file(file, storage, cif_output_dir, expand)
+
+    return len(files)
+
+
 # Moving this function outside output_file class increases performance
 def normalize_file(file, storage, cif_output_dir, expand):
     if not os.path.isfile(file):
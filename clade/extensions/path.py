@@ -16,24 +16,72 @@
 import glob
 import os
 import sys
+import ujson
 
 from clade.extensions.abstract import Extension
 
 
 class Path(Extension):
-    __version__ = "3"
+    """Normalizes paths and stores them in a single path table.
+
+    Path table is a text file, in which each line is a json array
+    with a key and a normalized path. New lines are only appended to it,
+    so it can be updated by several processes simultaneously, and
+    each process can read only the part that was added since its
+    previous read.
+    """
+
+    __version__ = "4"
+
+    incremental = True
 
     def __init__(self, work_dir, conf=None):
         super().__init__(work_dir, conf)
 
+        self.paths_file = os.path.join(self.work_dir, "paths.txt")
+
+        self.__pending = []
         self.paths = dict()
-        self.paths_folder = self.work_dir
+
+    @property
+    def paths(self):
+        return self.__paths
+
+    @paths.setter
+    def paths(self, paths):
+        self.__paths = paths
+        self.__paths.update(self.__pending)
+        # Path table will be read again from the very beginning
+        self.__offset = 0
 
     @Extension.prepare
     def parse(self, cmds_file):
         build_cwd = self.get_build_dir(cmds_file)
         self.conf["build_dir"] = self.normalize_abs_path(build_cwd)
 
+    def flush_data_by_key(self, recursive=True):
+        super().flush_data_by_key(recursive=recursive)
+
+        if not self.__pending:
+            return
+
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        # Single write to the file opened in append mode doesn't
+        # interleave with writes of other processes
+        data = "".join(
+            ujson.dumps(p, ensure_ascii=False, escape_forward_slashes=False) + "\n"
+            for p in self.__pending
+        ).encode("utf-8")
+        fd = os.open(self.paths_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+
+        self.__pending = []
+
     def get_rel_paths(self, paths, cwd):
         # TODO: check that paths is a list, not a string
         npaths = []
@@ -52,11 +100,14 @@ class Path(Extension):
         return self.__get_path_by_key(path, path)
 
     def __get_path_by_key(self, key, orig_path):
-        if key not in self.paths or key.lower() not in self.paths:
-            self.paths.update(self.load_paths_by_key(key))
+        # Keys are stored in lower case on Windows, and they are case-sensitive otherwise
+        if sys.platform == "win32":
+            key = key.lower()
+
+        if key not in self.paths:
+            self.load_paths()
 
-        # get data either by key, or by key.lower()
-        npath = self.paths.get(key, self.paths.get(key.lower()))
+        npath = self.paths.get(key)
 
         if not npath:
             npath = orig_path
@@ -67,9 +118,43 @@ class Path(Extension):
 
         return npath
 
+    def load_paths(self):
+        """Load paths that were added to the path table since the last call."""
+        try:
+            # Path table is not changed in most cases, so do not read it
+            if os.stat(self.paths_file).st_size == self.__offset:
+                return self.paths
+
+            with open(self.paths_file, "rb") as fh:
+                fh.seek(self.__offset)
+                data = fh.read()
+        except FileNotFoundError:
+            return self.paths
+
+        # Last line may be not completely written yet
+        end = data.rfind(b"\n") + 1
+        self.__offset += end
+
+        for line in data[:end].decode("utf-8").splitlines():
+            key, npath = ujson.loads(line)
+            self.paths[key] = npath
+
+        return self.paths
+
     def load_paths_by_key(self, key):
         """Load information about paths grouped by key."""
-        return self.load_data_by_key(self.paths_folder, [key, key.lower()])
+        if sys.platform == "win32":
+            key = key.lower()
+
+        paths = self.load_paths()
+        return {key: paths[key]} if key in paths else {}
+
+    def __store_path(self, key, npath):
+        self.paths[key] = npath
+        self.__pending.append((key, npath))
+
+        if len(self.__pending) >= self.conf.get("data_buffer_size", 0):
+            self.flush_data_by_key(recursive=False)
 
     def normalize_rel_paths(self, paths, cwd):
         # TODO: check that paths is a list, not a string
@@ -99,8 +184,7 @@ class Path(Extension):
         npath = self.normalize_abs_path(abs_path)
 
         if path != npath:
-            self.paths[key] = npath
-            self.dump_data_by_key({key: npath}, self.paths_folder)
+            self.__store_path(key, npath)
 
         return npath
 
@@ -124,8 +208,7 @@ class Path(Extension):
                 npath = "/" + drive[:-1] + tail
 
         if path != npath:
-            self.paths[key] = npath
-            self.dump_data_by_key({key: npath}, self.paths_folder)
+            self.__store_path(key, npath)
 
         return npath
 
@@ -25,6 +25,8 @@ from clade.extensions.abstract import Extension
 class PidGraph(Extension):
     __version__ = "1"
 
+    incremental = True
+
     def __init__(self, work_dir, conf=None):
         super().__init__(work_dir, conf)
 
@@ -38,9 +40,14 @@ class PidGraph(Extension):
 
     @Extension.prepare
     def parse(self, cmds_file):
-        self.log("Parsing {} commands".format(get_last_id(cmds_file, raise_exception=True)))
+        last_id = int(get_last_id(cmds_file, raise_exception=True))
+        self.log("Parsing {} commands".format(last_id - self.parsed_id))
+
+        if self.parsed_id:
+            self.graph = self.load_pid_graph()
+            self.pid_by_id = self.load_pid_by_id()
 
-        for cmd in iter_cmds(cmds_file):
+        for cmd in iter_cmds(cmds_file, after_id=self.parsed_id):
             self.pid_by_id[cmd["id"]] = cmd["pid"]
 
             self.graph[cmd["id"]] = [cmd["pid"]] + self.graph.get(cmd["pid"], [])
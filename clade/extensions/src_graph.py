@@ -16,11 +16,28 @@
 import os
 
 from clade.extensions.abstract import Extension
+from clade.extensions.cmd_graph import get_transitive_closure
+
+
+def cmd_sets_intersect(cmd_set1, cmd_set2):
+    """Check that two sets from SrcGraph.load_src_cmd_sets() have common commands."""
+    if type(cmd_set1) is int:
+        if type(cmd_set2) is int:
+            return (cmd_set1 & cmd_set2) != 0
+
+        cmd_set1, cmd_set2 = cmd_set2, cmd_set1
+
+    if type(cmd_set2) is int:
+        return any(cmd_set2 >> num & 1 for num in cmd_set1)
+
+    return not cmd_set1.isdisjoint(cmd_set2)
 
 
 class SrcGraph(Extension):
     __version__ = "1"
 
+    incremental = True
+
     always_requires = ["CmdGraph", "Path"]
     requires = always_requires + ["CC", "CL"]
 
@@ -46,6 +63,45 @@ class SrcGraph(Extension):
         else:
             return self.load_data(self.src_graph_file)
 
+    def load_src_cmd_sets(self, key, src_graph=None):
+        """Load "compiled_in" or "used_by" list of each source file as a set of commands.
+
+        Each command is replaced by a small number. Set is stored either as
+        an integer bitset, or as a frozenset of numbers if the bitset would be
+        too sparse, so memory is not wasted on files from few commands. Use
+        cmd_sets_intersect() to check that two such sets have common commands.
+        """
+        if src_graph is None:
+            src_graph = self.load_src_graph()
+
+        cmd_nums = dict()
+        cmd_sets = dict()
+
+        for file in src_graph:
+            file_nums = [
+                cmd_nums.setdefault(cmd_id, len(cmd_nums))
+                for cmd_id in src_graph[file][key]
+            ]
+
+            if not file_nums:
+                cmd_sets[file] = 0
+                continue
+
+            max_num = max(file_nums)
+
+            # Frozenset takes about 32 bytes per element
+            if max_num // 8 > 32 * len(file_nums):
+                cmd_sets[file] = frozenset(file_nums)
+                continue
+
+            bitset = bytearray(max_num // 8 + 1)
+            for num in file_nums:
+                bitset[num // 8] |= 1 << (num % 8)
+
+            cmd_sets[file] = int.from_bytes(bitset, "little")
+
+        return cmd_sets
+
     def load_src_info(self):
         """Load information about source files."""
         return self.load_data(self.src_info_file)
@@ -60,6 +116,10 @@ class SrcGraph(Extension):
             self.error("No commands to parse")
             raise RuntimeError
 
+        # Counting lines of code in already known source files is not needed
+        if self.parsed_id:
+            self.src_info = self.load_src_info()
+
         cmds = self.load_all_cmds()
         self.__generate_src_graph(cmds)
 
@@ -94,13 +154,15 @@ class SrcGraph(Extension):
         except FileNotFoundError:
             return
 
+        # used_by is a list of commands that use (possibly indirectly)
+        # output of the command with ID=cmd_id
+        used_by_closure = get_transitive_closure(cmd_graph, "used_by")
+
         for cmd in cmds:
             cmd_id = str(cmd["id"])
             cmd_type = cmd["type"]
 
-            # used_by is a list of commands that use (possibly indirectly)
-            # output of the command with ID=cmd_id
-            used_by = self.__find_used_by(cmd_graph, cmd_id)
+            used_by = used_by_closure.get(cmd_id, ())
 
             for src_file in self.extensions[cmd_type].load_deps_by_id(cmd_id):
                 norm_in = self.extensions["Path"].get_rel_path(
@@ -110,6 +172,7 @@ class SrcGraph(Extension):
                 if norm_in not in self.src_graph:
                     self.src_graph[norm_in] = self.__get_new_value()
 
+                if norm_in not in self.src_info:
                     abs_src_file = os.path.join(cmd["cwd"], src_file)
                     self.src_info[norm_in] = {
                         "loc": self.__count_file_loc(abs_src_file),
@@ -125,15 +188,6 @@ class SrcGraph(Extension):
             self.src_graph[file]["compiled_in"] = list(self.src_graph[file]["compiled_in"])
             self.src_graph[file]["used_by"] = list(self.src_graph[file]["used_by"])
 
-    def __find_used_by(self, cmd_graph, cmd_id):
-        used_by = set()
-
-        for used_by_id in cmd_graph[cmd_id]["used_by"]:
-            used_by.add(used_by_id)
-            used_by.update(self.__find_used_by(cmd_graph, used_by_id))
-
-        return used_by
-
     def __count_file_loc(self, file):
         """Count number of lines of code in the file."""
         try:
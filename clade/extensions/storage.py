@@ -18,19 +18,125 @@ try:
 except ImportError:
     import chardet
 
+import codecs
 import functools
+import hashlib
+import io
 import os
+import re
 import shutil
 import tempfile
+import zipfile
 
 from clade.extensions.abstract import Extension
 
 
+# Maximum size of the sample by which chardet detects encoding of the file
+CHARDET_SAMPLE_SIZE = 64 * 1024
+
+NON_ASCII_REGEX = re.compile(rb"[\x80-\xff]")
+
+
+def get_non_ascii_sample(content_bytes):
+    """Get lines of the file content that contain non-ASCII bytes."""
+    sample = []
+    sample_size = 0
+    pos = 0
+
+    while sample_size < CHARDET_SAMPLE_SIZE:
+        m = NON_ASCII_REGEX.search(content_bytes, pos)
+        if not m:
+            break
+
+        start = content_bytes.rfind(b"\n", 0, m.start()) + 1
+        pos = content_bytes.find(b"\n", m.end()) + 1 or len(content_bytes)
+
+        sample.append(content_bytes[start:pos])
+        sample_size += pos - start
+
+    return b"".join(sample)[:CHARDET_SAMPLE_SIZE]
+
+
+def detect_encoding(content_bytes):
+    """Detect encoding of the file content.
+
+    Most source files are in ASCII or UTF-8, which can be checked much
+    faster than chardet detects them, so chardet is used only for the
+    remaining files. Encoding depends only on non-ASCII bytes, so chardet
+    is given only lines that contain them, which are usually just a few comments.
+
+    Returns:
+        A tuple with the name of the encoding and the confidence of detection.
+    """
+    if content_bytes.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig", 1
+
+    # Strict decoding fails on the first byte that does not match the encoding
+    for encoding in ("ascii", "utf-8"):
+        try:
+            content_bytes.decode(encoding)
+            return encoding, 1
+        except UnicodeDecodeError:
+            pass
+
+    sample = get_non_ascii_sample(content_bytes)
+    detected = chardet.detect(sample)
+
+    # Sample does not contain all non-ASCII lines, and its
+    # encoding does not match the rest of the file
+    if len(sample) == CHARDET_SAMPLE_SIZE and not can_decode(content_bytes, detected["encoding"]):
+        detected = chardet.detect(content_bytes)
+
+    # For example, chardet can mistake Latin-1 for UTF-8
+    if not can_decode(content_bytes, detected["encoding"]):
+        return None, 0
+
+    return detected["encoding"], detected["confidence"]
+
+
+def can_decode(content_bytes, encoding):
+    if not encoding:
+        return False
+
+    try:
+        content_bytes.decode(encoding)
+        return True
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def unwrap(self, args):
+    return self.add_file(*args)
+
+
 class Storage(Extension):
     requires = ["Path"]
 
+    # Storage must not be removed if new commands were intercepted
+    incremental = True
+
     __version__ = "1"
 
+    def __init__(self, work_dir, conf=None):
+        super().__init__(work_dir, conf)
+
+        # Directory with content-addressed objects, shared between working directories
+        self.objects_dir = self.conf.get("Storage.objects_dir")
+        if self.objects_dir:
+            self.objects_dir = os.path.abspath(self.objects_dir)
+
+        # Compressed pack with all files from the storage
+        self.pack_file = os.path.join(self.work_dir, ".storage.zip")
+        self.__pack = None
+        self.__pack_id = None
+
+    def __getstate__(self):
+        # Opened pack can't be pickled and must not be shared between processes
+        state = self.__dict__.copy()
+        state["_Storage__pack"] = None
+        state["_Storage__pack_id"] = None
+        return state
+
     def add_file(self, filename, storage_filename=None, encoding=None):
         """Add file to the storage.
 
@@ -60,6 +166,36 @@ class Storage(Extension):
         except shutil.SameFileError:
             pass
 
+    def add_files(self, filenames, encoding=None):
+        """Add several files to the storage.
+
+        If files are converted to UTF-8, they are added in child processes,
+        since detection of their encoding takes much more time than copying.
+
+        Args:
+            filenames: List of paths to the files
+            encoding: encoding of the files, like in add_file()
+        """
+        filenames = [
+            filename for filename in dict.fromkeys(filenames)
+            if not self.__path_exists(
+                self.work_dir + os.sep + self.extensions["Path"].normalize_abs_path(filename)
+            )
+        ]
+
+        if not filenames:
+            return
+
+        if not self.conf.get("Storage.convert_to_utf8"):
+            for filename in filenames:
+                self.add_file(filename, encoding=encoding)
+        else:
+            self.log("Converting {} files to UTF-8".format(len(filenames)))
+            self.parse_cmds_in_parallel(((filename, None, encoding) for filename in filenames), unwrap)
+
+        # Files were added, so cached results of the existence check are outdated
+        self.__path_exists.cache_clear()
+
     @functools.lru_cache(maxsize=30000)
     def __path_exists(self, path):
         return os.path.exists(path)
@@ -68,15 +204,13 @@ class Storage(Extension):
         os.makedirs(os.path.dirname(dst), exist_ok=True)
 
         if not self.conf.get("Storage.convert_to_utf8"):
-            shutil.copyfile(filename, dst)
+            self.__copy_file_as_is(filename, dst)
         else:
             with open(filename, "rb") as fh:
                 content_bytes = fh.read()
 
             if not encoding:
-                detected = chardet.detect(content_bytes)
-                encoding = detected["encoding"]
-                confidence = detected["confidence"]
+                encoding, confidence = detect_encoding(content_bytes)
             else:
                 # Encoding is specified by the user
                 confidence = 1
@@ -87,16 +221,21 @@ class Storage(Extension):
                         filename
                     )
                 )
-                shutil.copyfile(filename, dst)
+                self.__copy_file_as_is(filename, dst)
+                return
+
+            # Encode file content to utf-8
+            content_bytes = content_bytes.decode(encoding).encode("utf-8")
+            # Convert CRLF line endings to LF
+            content_bytes = content_bytes.replace(b"\r\n", b"\n")
+
+            if self.objects_dir:
+                self.__add_object(content_bytes, dst)
                 return
 
             with tempfile.NamedTemporaryFile(
                 mode="wb", delete=False
             ) as f:
-                # Encode file content to utf-8
-                content_bytes = content_bytes.decode(encoding).encode("utf-8")
-                # Convert CRLF line endings to LF
-                content_bytes = content_bytes.replace(b"\r\n", b"\n")
                 f.write(content_bytes)
 
             try:
@@ -104,6 +243,161 @@ class Storage(Extension):
             except OSError:
                 os.remove(f.name)
 
+    def __copy_file_as_is(self, filename, dst):
+        if not self.objects_dir:
+            shutil.copyfile(filename, dst)
+            return
+
+        with open(filename, "rb") as fh:
+            self.__add_object(fh.read(), dst)
+
+    def __add_object(self, content_bytes, dst):
+        """Store content in the objects directory and link it to the storage."""
+        digest = hashlib.sha256(content_bytes).hexdigest()
+        obj = os.path.join(self.objects_dir, digest[:2], digest)
+
+        if not os.path.exists(obj):
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+
+            # Object appears atomically, even if several
+            # processes are trying to store it simultaneously
+            fd, tmp_obj = tempfile.mkstemp(dir=os.path.dirname(obj))
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(content_bytes)
+
+            # Objects are shared, so they must not be changed through any of the links
+            os.chmod(tmp_obj, 0o444)
+            os.replace(tmp_obj, obj)
+
+        try:
+            os.link(obj, dst)
+        except FileExistsError:
+            # File was added to the storage by another process
+            pass
+        except OSError:
+            # Objects directory is located on another file system,
+            # or the limit of links to the object is reached
+            shutil.copyfile(obj, dst)
+
+    def pack(self):
+        """Move all files from the storage into the compressed pack."""
+        files = []
+        for root, _, filenames in os.walk(self.work_dir):
+            for filename in filenames:
+                file = os.path.join(root, filename)
+
+                if file != self.pack_file:
+                    files.append(file)
+
+        if not files:
+            return
+
+        self.log("Packing {} files from the storage".format(len(files)))
+
+        with zipfile.ZipFile(self.pack_file, "a", compression=zipfile.ZIP_DEFLATED) as zf:
+            packed = set(zf.namelist())
+
+            for file in files:
+                name = self.__get_pack_name(os.path.relpath(file, start=self.work_dir))
+
+                if name not in packed:
+                    zf.write(file, arcname=name)
+
+        for path in os.listdir(self.work_dir):
+            path = os.path.join(self.work_dir, path)
+
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif path != self.pack_file:
+                os.remove(path)
+
+    def unpack(self):
+        """Extract all files from the compressed pack back into the storage."""
+        if not os.path.isfile(self.pack_file):
+            return
+
+        self.log("Unpacking files to the storage")
+
+        with zipfile.ZipFile(self.pack_file, "r") as zf:
+            zf.extractall(self.work_dir)
+
+        self.__close_pack()
+        os.remove(self.pack_file)
+
+    def file_exists(self, path):
+        """Check that file exists in the storage, whether it is packed or not."""
+        if os.path.isfile(self.get_storage_path(path)):
+            return True
+
+        pack = self.__get_pack()
+        if not pack:
+            return False
+
+        return self.__get_pack_name(path) in pack.NameToInfo
+
+    def open_file(self, path, mode="r", encoding=None, errors=None):
+        """Open file from the storage for reading, whether it is packed or not.
+
+        Packed files are decompressed on demand, so only the
+        requested file is read from the pack.
+        """
+        if mode not in ("r", "rb"):
+            raise ValueError("Files from the storage can be opened only for reading")
+
+        storage_path = self.get_storage_path(path)
+
+        if os.path.isfile(storage_path):
+            return open(storage_path, mode, encoding=encoding, errors=errors)
+
+        pack = self.__get_pack()
+
+        try:
+            if not pack:
+                raise KeyError
+
+            fh = pack.open(self.__get_pack_name(path))
+        except KeyError:
+            raise FileNotFoundError("{!r} file is not found in the storage".format(path))
+
+        if mode == "rb":
+            return fh
+
+        return io.TextIOWrapper(fh, encoding=encoding, errors=errors)
+
+    def read_file(self, path, mode="r", encoding=None, errors=None):
+        """Read content of the file from the storage, whether it is packed or not."""
+        with self.open_file(path, mode=mode, encoding=encoding, errors=errors) as fh:
+            return fh.read()
+
+    def __get_pack(self):
+        try:
+            stat = os.stat(self.pack_file)
+        except FileNotFoundError:
+            self.__close_pack()
+            return None
+
+        # Pack can be changed by another object, and its file object
+        # can't be shared with child processes
+        pack_id = (os.getpid(), stat.st_mtime_ns, stat.st_size)
+
+        if self.__pack_id != pack_id:
+            self.__close_pack()
+            self.__pack = zipfile.ZipFile(self.pack_file, "r")
+            self.__pack_id = pack_id
+
+        return self.__pack
+
+    def __close_pack(self):
+        if self.__pack and self.__pack_id[0] == os.getpid():
+            self.__pack.close()
+
+        self.__pack = None
+        self.__pack_id = None
+
+    @staticmethod
+    def __get_pack_name(path):
+        return path.lstrip(os.path.sep).replace(os.path.sep, "/")
+
     def get_storage_dir(self):
         return self.work_dir
 
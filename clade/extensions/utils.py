@@ -20,6 +20,50 @@ def nested_dict():
     return collections.defaultdict(nested_dict)
 
 
+class StringTable:
+    """Table of unique strings, such as file paths and function names.
+
+    Each string added to the table gets an integer id, and all
+    equal strings are represented by a single object, which
+    considerably reduces memory usage of large nested dictionaries.
+    """
+
+    def __init__(self):
+        self.__ids = dict()
+        self.__strings = []
+
+    def __len__(self):
+        return len(self.__strings)
+
+    def __contains__(self, string):
+        return string in self.__ids
+
+    def get_id(self, string):
+        """Get id of the string, adding it to the table if necessary."""
+        string_id = self.__ids.get(string)
+
+        if string_id is None:
+            string_id = self.__ids[string] = len(self.__strings)
+            self.__strings.append(string)
+
+        return string_id
+
+    def get_str(self, string_id):
+        """Get string by its id."""
+        return self.__strings[string_id]
+
+    def intern(self, string):
+        """Get the object from the table that is equal to the string."""
+        if string is None:
+            return None
+
+        return self.__strings[self.get_id(string)]
+
+    def clear(self):
+        self.__ids.clear()
+        self.__strings.clear()
+
+
 def traverse(ndict, depth, restrict=None, allow_smaller=False):
     """Traverse nested dictionary and yield list of its elements.
 
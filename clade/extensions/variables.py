@@ -37,12 +37,11 @@ class Variables(Callgraph):
         self.used_in_vars_file = "used_in_vars.json"
 
         self.functions = None
-        self.src_graph = None
 
     @Extension.prepare
     def parse(self, cmds_file):
         self.functions = self.extensions["Functions"].load_functions()
-        self.src_graph = self.extensions["SrcGraph"].load_src_graph()
+        self._load_src_graph()
 
         self.__process_init_global()
         self._clean_error_log()
@@ -51,7 +50,7 @@ class Variables(Callgraph):
         self.dump_data(self.used_in_vars, self.used_in_vars_file, indent=4)
 
         self.functions.clear()
-        self.src_graph.clear()
+        self._clear_src_graph()
         self.variables.clear()
         self.used_in_vars.clear()
 
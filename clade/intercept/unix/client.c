@@ -24,7 +24,9 @@
 #include <netinet/in.h>
 #include <arpa/inet.h>
 
-static void send_data_unix(const char *msg, char *address) {
+#include "env.h"
+
+static int connect_unix(char *address) {
     int sockfd;
 
     struct sockaddr_un addr;
@@ -40,15 +42,10 @@ static void send_data_unix(const char *msg, char *address) {
         exit(EXIT_FAILURE);
     }
 
-    int ret = write(sockfd, msg, strlen(msg));
-
-    // We need to wait until the server finished message processing and close the socket
-    char buf[1024];
-    ssize_t r;
-    while ((r = read(sockfd, buf, sizeof(buf)-1)) > 0) {}
+    return sockfd;
 }
 
-static void send_data_inet(const char *msg, char *host, char *port) {
+static int connect_inet(char *host, char *port) {
     int sockfd;
 
     struct sockaddr_in addr;
@@ -69,26 +66,21 @@ static void send_data_inet(const char *msg, char *host, char *port) {
         exit(EXIT_FAILURE);
     }
 
-    int ret = write(sockfd, msg, strlen(msg));
-
-    // We need to wait until the server finished message processing and close the socket
-    char buf[1024];
-    ssize_t r;
-    while ((r = read(sockfd, buf, sizeof(buf)-1)) > 0) {}
+    return sockfd;
 }
 
-char *send_data(const char *msg) {
+int connect_to_server() {
     char* host = getenv("CLADE_INET_HOST");
     char* port = getenv("CLADE_INET_PORT");
     char* address = getenv("CLADE_UNIX_ADDRESS");
 
     // Use UNIX sockets if address is not NULL
     if (address) {
-        send_data_unix(msg, address);
+        return connect_unix(address);
     }
     // Else try to use TCP/IP sockets
     else if (host && port) {
-        send_data_inet(msg, host, port);
+        return connect_inet(host, port);
     }
     else {
         perror("Server adress is not specified");
@@ -96,3 +88,43 @@ char *send_data(const char *msg) {
     }
 }
 
+// Server can reply with environment variables ("NAME=VALUE" lines)
+// that must be set for the intercepted command
+static void set_reply_env(char *reply) {
+    char *saveptr;
+
+    clear_extra_env();
+
+    for (char *line = strtok_r(reply, "\n", &saveptr); line; line = strtok_r(NULL, "\n", &saveptr)) {
+        char *value = strchr(line, '=');
+
+        if (!value)
+            continue;
+
+        *value = '\0';
+        add_extra_env(line, value + 1);
+    }
+}
+
+void send_data(int sockfd, const char *msg) {
+    int ret = write(sockfd, msg, strlen(msg));
+
+    // We need to wait until the server finished message processing and close the socket
+    size_t reply_size = 1024, reply_len = 0;
+    char *reply = malloc(reply_size);
+    ssize_t r;
+    while ((r = read(sockfd, reply + reply_len, reply_size - reply_len - 1)) > 0) {
+        reply_len += r;
+
+        if (reply_len + 1 == reply_size) {
+            reply_size *= 2;
+            reply = realloc(reply, reply_size);
+        }
+    }
+
+    close(sockfd);
+
+    reply[reply_len] = '\0';
+    set_reply_env(reply);
+    free(reply);
+}
@@ -18,6 +18,7 @@
 #ifndef CLIENT_H
 #define CLIENT_H
 
-extern void send_data(const char *msg);
+extern int connect_to_server();
+extern void send_data(int sockfd, const char *msg);
 
 #endif /* CLIENT_H */
@@ -16,9 +16,13 @@
  */
 
 #include <sys/file.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <time.h>
 #include <unistd.h>
 
 #include "which.h"
@@ -27,6 +31,12 @@
 
 #define DELIMITER "||"
 
+#define BINARY_MAGIC "\0CLD"
+// magic, size, id, parent id, pid, timestamp, hash of the environment
+#define BINARY_HEADER_SIZE (4 + 4 + 4 + 4 + 4 + 8 + 8)
+
+extern char **environ;
+
 static void expand_newlines(char *dest, const char *src) {
     for (int i = 0; i < strlen(src); i++) {
         switch(src[i]) {
@@ -58,25 +68,17 @@ static char *expand_newlines_alloc(const char *src) {
     return dest;
 }
 
-static char *prepare_data(const char *path, char const *const argv[]) {
-    unsigned args_len = 1, written_len = 0;
-
-    // Concatenate all command-line arguments together using "||" as delimeter.
-    for (const char *const *arg = argv; arg && *arg; arg++) {
-        // Argument might be replaced by a new large string with escaped newlines
-        args_len += 2 * strlen(*arg) + 1;
-        // Each separator will require 2 additional bytes
-        if ((arg + 1) && *(arg + 1))
-            args_len += 2;
-    }
-
-    // Get current working directory
+static const char *get_cwd() {
     const char *cwd = getcwd(NULL, 0);
     if (!cwd) {
         fprintf(stderr, "Couldn't get current working directory");
         exit(EXIT_FAILURE);
     }
 
+    return cwd;
+}
+
+static char *get_correct_path(const char *path) {
     // Sometimes "path" contains incorrect values ("gcc" instead of "/usr/bin/gcc")
     char *correct_path = NULL;
     if (access(path, X_OK)) {
@@ -87,6 +89,24 @@ static char *prepare_data(const char *path, char const *const argv[]) {
         correct_path = (char *)path;
     }
 
+    return correct_path;
+}
+
+static char *prepare_data(const char *path, char const *const argv[]) {
+    unsigned args_len = 1, written_len = 0;
+
+    // Concatenate all command-line arguments together using "||" as delimeter.
+    for (const char *const *arg = argv; arg && *arg; arg++) {
+        // Argument might be replaced by a new large string with escaped newlines
+        args_len += 2 * strlen(*arg) + 1;
+        // Each separator will require 2 additional bytes
+        if ((arg + 1) && *(arg + 1))
+            args_len += 2;
+    }
+
+    const char *cwd = get_cwd();
+    char *correct_path = get_correct_path(path);
+
     // Allocate memory to store the data + cwd + which + PID (50) + delimeters.
     char *data = malloc(args_len + strlen(cwd) + strlen(DELIMITER) + 500 + strlen(DELIMITER)
                         + strlen(correct_path) + strlen(DELIMITER) + strlen("\n"));
@@ -121,6 +141,91 @@ static char *prepare_data(const char *path, char const *const argv[]) {
     return data;
 }
 
+// FNV-1a hash of all environment variables
+static uint64_t get_environ_hash() {
+    uint64_t hash = 14695981039346656037ULL;
+
+    for (char **env = environ; env && *env; env++) {
+        for (const unsigned char *c = (const unsigned char *)*env; *c; c++) {
+            hash = (hash ^ *c) * 1099511628211ULL;
+        }
+        hash = (hash ^ 0) * 1099511628211ULL;
+    }
+
+    return hash;
+}
+
+/* Binary record consists of a header with fixed size fields in native byte
+ * order and a list of null-terminated strings: cwd, which and arguments.
+ * Arguments are stored as is, so newlines are not escaped.
+ * Header must be in sync with BINARY_HEADER from clade/cmds.py.
+ */
+static char *prepare_binary_data(const char *path, char const *const argv[], uint32_t *size) {
+    const char *cwd = get_cwd();
+    char *correct_path = get_correct_path(path);
+
+    uint32_t record_size = BINARY_HEADER_SIZE + strlen(cwd) + 1 + strlen(correct_path) + 1;
+    for (const char *const *arg = argv; arg && *arg; arg++) {
+        record_size += strlen(*arg) + 1;
+    }
+
+    char *data = malloc(record_size);
+    if (!data) {
+        fprintf(stderr, "Couldn't allocate memory\n");
+        exit(EXIT_FAILURE);
+    }
+
+    char *parent_id_str = get_parent_id();
+    // After get_parent_id() CLADE_PARENT_ID contains id of the current command
+    uint32_t id = atoi(getenv("CLADE_PARENT_ID"));
+    uint32_t parent_id = atoi(parent_id_str);
+    free(parent_id_str);
+
+    uint32_t pid = getpid();
+
+    struct timespec ts;
+    clock_gettime(CLOCK_REALTIME, &ts);
+    uint64_t timestamp = (uint64_t)ts.tv_sec * 1000000000ULL + ts.tv_nsec;
+
+    uint64_t env_hash = get_environ_hash();
+
+    char *p = data;
+    memcpy(p, BINARY_MAGIC, 4);
+    p += 4;
+    memcpy(p, &record_size, sizeof(record_size));
+    p += sizeof(record_size);
+    memcpy(p, &id, sizeof(id));
+    p += sizeof(id);
+    memcpy(p, &parent_id, sizeof(parent_id));
+    p += sizeof(parent_id);
+    memcpy(p, &pid, sizeof(pid));
+    p += sizeof(pid);
+    memcpy(p, &timestamp, sizeof(timestamp));
+    p += sizeof(timestamp);
+    memcpy(p, &env_hash, sizeof(env_hash));
+    p += sizeof(env_hash);
+
+    p = stpcpy(p, cwd) + 1;
+    p = stpcpy(p, correct_path) + 1;
+    for (const char *const *arg = argv; arg && *arg; arg++) {
+        p = stpcpy(p, *arg) + 1;
+    }
+
+    *size = record_size;
+    return data;
+}
+
+static void store_binary_data(char *data, uint32_t size, char *data_file) {
+    FILE *f = fopen(data_file, "ab");
+    if (!f) {
+        fprintf(stderr, "Couldn't open %s file\n", data_file);
+        exit(EXIT_FAILURE);
+    }
+
+    fwrite(data, 1, size, f);
+    fclose(f);
+}
+
 static void store_data(char *data, char *data_file) {
     FILE *f = fopen(data_file, "a");
     if (!f) {
@@ -132,6 +237,23 @@ static void store_data(char *data, char *data_file) {
     fclose(f);
 }
 
+// Each process appends commands to its own spool file, so no locks are needed.
+// Lines are prefixed with command ids, which are used to merge spool files later.
+static void spool_data(char *data, char *spool_dir) {
+    char spool_file[PATH_MAX];
+    snprintf(spool_file, sizeof(spool_file), "%s/%d", spool_dir, getpid());
+
+    int fd = open(spool_file, O_WRONLY | O_APPEND | O_CREAT, 0644);
+    if (fd == -1) {
+        fprintf(stderr, "Couldn't open %s file\n", spool_file);
+        exit(EXIT_FAILURE);
+    }
+
+    // After prepare_data() CLADE_PARENT_ID contains id of the current command
+    dprintf(fd, "%s %s", getenv("CLADE_PARENT_ID"), data);
+    close(fd);
+}
+
 void intercept_call(const char *path, char const *const argv[]) {
     char *data_file = getenv("CLADE_INTERCEPT");
     char *id_file = getenv("CLADE_ID_FILE");
@@ -146,6 +268,14 @@ void intercept_call(const char *path, char const *const argv[]) {
         exit(EXIT_FAILURE);
     }
 
+    char *spool_dir = getenv("CLADE_SPOOL_DIR");
+    if (spool_dir) {
+        char *data = prepare_data(path, argv);
+        spool_data(data, spool_dir);
+        free(data);
+        return;
+    }
+
     FILE *f = fopen(id_file, "r");
     if (!f) {
         fprintf(stderr, "Couldn't open %s file\n", id_file);
@@ -153,15 +283,34 @@ void intercept_call(const char *path, char const *const argv[]) {
     }
     flock(fileno(f), LOCK_EX);
 
-    // Data with intercepted command which will be stored
-    char *data = prepare_data(path, argv);
+    if (getenv("CLADE_PREPROCESS")) {
+        // Data with intercepted command which will be stored
+        char *data = prepare_data(path, argv);
+
+        // Server accepts connections in the order of command ids, so the lock
+        // can be released before the command is preprocessed
+        int sockfd = connect_to_server();
 
-    if (getenv("CLADE_PREPROCESS"))
-        send_data(data);
-    else
+        flock(fileno(f), LOCK_UN);
+        fclose(f);
+
+        send_data(sockfd, data);
+        free(data);
+    } else if (getenv("CLADE_BINARY")) {
+        uint32_t size;
+        char *data = prepare_binary_data(path, argv, &size);
+        store_binary_data(data, size, data_file);
+        free(data);
+
+        flock(fileno(f), LOCK_UN);
+        fclose(f);
+    } else {
+        // Data with intercepted command which will be stored
+        char *data = prepare_data(path, argv);
         store_data(data, data_file);
-    free(data);
+        free(data);
 
-    fclose(f);
-    flock(fileno(f), LOCK_UN);
+        flock(fileno(f), LOCK_UN);
+        fclose(f);
+    }
 }
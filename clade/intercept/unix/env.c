@@ -16,14 +16,27 @@
  */
 
 #include <sys/file.h>
+#include <sys/mman.h>
+#include <fcntl.h>
+#include <stdint.h>
 #include <stdlib.h>
 #include <string.h>
 #include <stdio.h>
+#include <unistd.h>
 
 #include "env.h"
 
 static char *key = "CLADE_PARENT_ID";
 
+// Environment variables that were requested by the preprocess server
+// for the currently intercepted command
+#define MAX_EXTRA_ENV 16
+static char *extra_env_names[MAX_EXTRA_ENV];
+static char *extra_env_values[MAX_EXTRA_ENV];
+static int extra_env_len = 0;
+
+static void set_envp_value(char **envp, const char *name, const char *value);
+
 static int get_envp_len(char **envp) {
     int i;
     for(i = 0; envp[i] != NULL; i++);
@@ -32,7 +45,8 @@ static int get_envp_len(char **envp) {
 
 static char **copy_envp(char **envp) {
     int envp_len = get_envp_len(envp);
-    char **copy = malloc((envp_len + 1) * sizeof(char *));
+    // Reserve space for extra environment variables
+    char **copy = malloc((envp_len + extra_env_len + 1) * sizeof(char *));
 
     int i;
     for (i = 0; i < envp_len; i++) {
@@ -75,9 +89,59 @@ char **update_envp(char **input_envp) {
     int i = find_parent_id(envp);
     free(envp[i]);
     envp[i] = new_value;
+
+    for (int j = 0; j < extra_env_len; j++) {
+        set_envp_value(envp, extra_env_names[j], extra_env_values[j]);
+    }
+
     return envp;
 }
 
+// envp must have enough space to store a new variable
+static void set_envp_value(char **envp, const char *name, const char *value) {
+    size_t name_len = strlen(name);
+    size_t new_value_len = name_len + strlen(value) + 2;
+    char *new_value = malloc(new_value_len);
+    snprintf(new_value, new_value_len, "%s=%s", name, value);
+
+    int i;
+    for (i = 0; envp[i] != NULL; i++) {
+        if (strncmp(envp[i], name, name_len) == 0 && envp[i][name_len] == '=') {
+            free(envp[i]);
+            envp[i] = new_value;
+            return;
+        }
+    }
+
+    envp[i] = new_value;
+    envp[i + 1] = NULL;
+}
+
+void clear_extra_env() {
+    for (int i = 0; i < extra_env_len; i++) {
+        free(extra_env_names[i]);
+        free(extra_env_values[i]);
+    }
+
+    extra_env_len = 0;
+}
+
+void add_extra_env(const char *name, const char *value) {
+    if (extra_env_len < MAX_EXTRA_ENV) {
+        extra_env_names[extra_env_len] = strdup(name);
+        extra_env_values[extra_env_len] = strdup(value);
+        extra_env_len++;
+    }
+}
+
+// Must be used only if the current process is going to be replaced by the intercepted command,
+// otherwise variables will be inherited by all its children
+void apply_extra_env() {
+    for (int i = 0; i < extra_env_len; i++) {
+        setenv(extra_env_names[i], extra_env_values[i], 1);
+    }
+}
+
 void update_environ(char **envp) {
     if (!envp)
         return;
@@ -86,9 +150,35 @@ void update_environ(char **envp) {
     setenv(key, strchr(envp[i], '=') + 1, 1);
 }
 
+// In spool mode id file contains binary counter that is shared between
+// all intercepted processes and incremented atomically without any locks
+static int get_spool_cmd_id(char *id_file) {
+    int fd = open(id_file, O_RDWR);
+    if (fd == -1) {
+        fprintf(stderr, "Couldn't open %s file\n", id_file);
+        exit(EXIT_FAILURE);
+    }
+
+    int64_t *counter = mmap(NULL, sizeof(int64_t), PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    if (counter == MAP_FAILED) {
+        fprintf(stderr, "Couldn't map %s file into memory\n", id_file);
+        exit(EXIT_FAILURE);
+    }
+
+    int id = (int)__atomic_add_fetch(counter, 1, __ATOMIC_SEQ_CST);
+
+    munmap(counter, sizeof(int64_t));
+    close(fd);
+
+    return id;
+}
+
 static int get_cmd_id() {
     char *id_file = getenv("CLADE_ID_FILE");
 
+    if (getenv("CLADE_SPOOL_DIR"))
+        return get_spool_cmd_id(id_file);
+
     FILE *f = fopen(id_file, "r");
     if (!f) {
         fprintf(stderr, "Couldn't open %s file for read\n", id_file);
@@ -5,5 +5,8 @@ extern char **update_envp(char **input_envp);
 extern void update_environ(char **envp);
 
 extern char *get_parent_id();
+extern void clear_extra_env();
+extern void add_extra_env(const char *name, const char *value);
+extern void apply_extra_env();
 
 #endif /* ENV_H */
@@ -59,6 +59,7 @@ int execvp(const char *filename, char *const argv[]) {
 
     if (! intercepted) {
         intercept_call(filename, (char const *const *)argv);
+        apply_extra_env();
         // DO NOT change value of intercepted to TRUE here
     }
 
@@ -71,6 +72,7 @@ int execv(const char *filename, char *const argv[]) {
     // DO NOT check if (! intercepted) here: it will result in command loss
     // Also DO NOT change value of intercepted to TRUE for the same reason
     intercept_call(filename, (char const *const *)argv);
+    apply_extra_env();
     // BUT we need to change it for macOS to avoid duplicating commands
     #ifdef __APPLE__
     intercepted = true;
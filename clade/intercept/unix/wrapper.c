@@ -22,10 +22,13 @@
 #include <unistd.h>
 
 #include "data.h"
+#include "env.h"
 #include "which.h"
 
 #define wrapper_postfix ".clade"
 
+extern char **environ;
+
 
 int main(int argc, char **argv, char **envp) {
     char *original_exe = malloc(strlen(argv[0]) + strlen(wrapper_postfix) + 1);
@@ -53,7 +56,9 @@ int main(int argc, char **argv, char **envp) {
         // First argument must be a valid path, not just a filename
         argv[0] = original_exe;
         // Execute original file
-        return execve(original_exe, argv, envp);
+        // Environment could be changed by intercept_call(), so envp can't be used
+        apply_extra_env();
+        return execve(original_exe, argv, environ);
     } else {
         // Otherwise directory with wrappers is located in the PATH variable
         char *path = strstr(strdup(getenv("PATH")), WHICH_DELIMITER);
@@ -68,7 +73,8 @@ int main(int argc, char **argv, char **envp) {
 
         // First argument must be a valid path, not just a filename
         argv[0] = which;
-        return execve(which, argv, envp);
+        apply_extra_env();
+        return execve(which, argv, environ);
     }
 
     fprintf(stderr, "Something went wrong\n");
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
 import multiprocessing
 import threading
 import os
@@ -30,23 +31,70 @@ else:
     parent = socketserver.TCPServer
 
 
-# Forking and threading versions can be created using
-# the ForkingMixIn and ThreadingMixIn mix-in classes.
-# For instance, a forking CladeSocketServer class is created as follows:
-# class SocketServer(ForkingMixIn, parent):
+class OrderedOutput:
+    """File with intercepted commands that is kept open while the server is running.
+
+    Lines are written in the order in which their connections were accepted,
+    even if requests are processed concurrently and finish in another order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = None
+        self.lock = threading.Lock()
+        self.next_seq = 0
+        self.pending = dict()
+
+    def write(self, seq, line):
+        """Write line with the specified sequence number.
+
+        Line can be None, if the request failed, so its sequence number is simply skipped.
+        """
+        with self.lock:
+            if not self.fh:
+                self.fh = open(self.path, "a")
+
+            self.pending[seq] = line
+
+            while self.next_seq in self.pending:
+                line = self.pending.pop(self.next_seq)
+                self.next_seq += 1
+
+                if line is not None:
+                    self.fh.write(line + "\n")
+
+    def flush(self):
+        with self.lock:
+            if self.fh:
+                self.fh.flush()
+
+
 class SocketServer(parent):
+    # Intercepting library connects to the server while holding the lock on
+    # the file with command ids, so connections are accepted in the order of ids
+    request_queue_size = 128
+
     class RequestHandler(socketserver.StreamRequestHandler):
         def handle(self):
+            self.line = None
+
             data = self.rfile.readline().strip().decode("utf-8")
+
+            if not data:
+                return
+
             cmd = split_cmd(data)
 
             for ext in self.extensions:
                 ext.preprocess(cmd)
 
-            data = join_cmd(cmd)
+            # Extensions can ask to set environment variables of the intercepted command
+            env = cmd.pop("env", dict())
+
+            self.line = join_cmd(cmd)
 
-            with open(self.output, "a") as clade_fh:
-                clade_fh.write(data + "\n")
+            for key, value in env.items():
+                self.wfile.write("{}={}\n".format(key, value).encode("utf-8"))
 
     def __init__(self, address, output, conf):
         self.process = None
@@ -55,16 +103,61 @@ class SocketServer(parent):
 
         rh = SocketServer.RequestHandler
 
-        rh.output = output
+        # Extensions may need to know where intercepted commands are stored
+        conf = dict(conf, cmds_file=os.path.abspath(output))
 
         # Request handler must have access to extensions
+        # Each extension gets its own copy of configuration, since some of them (Info) change it
         extensions = []
         for cls in Extension.get_all_extensions():
-            extensions.append(cls(conf.get("work_dir", "Clade"), conf))
+            extensions.append(cls(conf.get("work_dir", "Clade"), dict(conf)))
         rh.extensions = extensions
 
+        self.output = OrderedOutput(output)
+
+        # Preprocessing of commands is done by a pool of threads,
+        # since extensions mostly wait for external tools, like the preprocessor
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=conf.get("cpu_count") or os.cpu_count()
+        )
+        self.seq = 0
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+
         super().__init__(address, rh)
 
+    def process_request(self, request, client_address):
+        with self.in_flight_lock:
+            self.in_flight += 1
+
+        self.pool.submit(self.process_request_thread, request, client_address, self.seq)
+        self.seq += 1
+
+    def process_request_thread(self, request, client_address, seq):
+        try:
+            self.finish_request(request, client_address, seq)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.in_flight_lock:
+                self.in_flight -= 1
+                idle = not self.in_flight
+
+            # Output is flushed before the connection is closed, so all commands
+            # are in the file by the time the last intercepted command is executed
+            if idle:
+                self.output.flush()
+
+            self.shutdown_request(request)
+
+    def finish_request(self, request, client_address, seq):
+        line = None
+
+        try:
+            line = self.RequestHandlerClass(request, client_address, self).line
+        finally:
+            self.output.write(seq, line)
+
     def start(self):
         if sys.platform == "win32" or (sys.platform == "darwin" and sys.version_info[1] >= 8):
             self.process = threading.Thread(target=self.serve_forever)
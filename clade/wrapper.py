@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os
 import tempfile
 import shutil
@@ -23,7 +24,8 @@ from clade.abstract import Intercept
 
 class Wrapper(Intercept):
     def __init__(self, command, cwd=os.getcwd(), output="cmds.txt", append=False, conf=None):
-        self.wrappers_dir = tempfile.mkdtemp()
+        self.wrappers_dir = None
+        self.cache_dir = None
 
         super().__init__(command, cwd, output, append, conf)
 
@@ -33,6 +35,15 @@ class Wrapper(Intercept):
     def _setup_env(self):
         env = super()._setup_env()
 
+        # Directory with path wrappers, shared between runs
+        self.cache_dir = self.conf.get("Wrapper.cache_dir")
+
+        if self.cache_dir:
+            self.cache_dir = os.path.abspath(self.cache_dir)
+            self.wrappers_dir = os.path.join(self.cache_dir, self.__get_cache_key())
+        else:
+            self.wrappers_dir = tempfile.mkdtemp()
+
         env["PATH"] = self.wrappers_dir + os.pathsep + os.environ.get("PATH", "")
         self.logger.debug("Add directory with wrappers to PATH: {!r}".format(self.wrappers_dir))
 
@@ -52,14 +63,56 @@ class Wrapper(Intercept):
         self.__create_path_wrappers()
         self.__create_exe_wrappers()
 
+    def __get_cache_key(self):
+        """Get key of the directory with path wrappers in the cache.
+
+        Directory modification time changes when executable files are added
+        to it or removed from it, so it is enough to take it into account.
+        """
+        h = hashlib.md5()
+
+        wrapper = os.path.join(os.path.dirname(__file__), "intercept", "wrapper")
+        h.update("{} {}\n".format(wrapper, os.stat(wrapper).st_mtime_ns).encode("utf-8"))
+
+        for path in os.environ.get("PATH", "").split(os.pathsep):
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+
+            h.update("{} {}\n".format(path, mtime).encode("utf-8"))
+
+        return h.hexdigest()
+
     def __create_path_wrappers(self):
-        self.logger.debug("Create temporary directory for wrappers: {!r}".format(self.wrappers_dir))
+        if not self.cache_dir:
+            self.logger.debug("Create temporary directory for wrappers: {!r}".format(self.wrappers_dir))
 
-        if os.path.exists(self.wrappers_dir):
-            shutil.rmtree(self.wrappers_dir)
+            if os.path.exists(self.wrappers_dir):
+                shutil.rmtree(self.wrappers_dir)
+
+            os.makedirs(self.wrappers_dir)
+            self.__fill_wrappers_dir(self.wrappers_dir)
+            return
+
+        if os.path.isdir(self.wrappers_dir):
+            self.logger.debug("Use cached directory with wrappers: {!r}".format(self.wrappers_dir))
+            return
 
-        os.makedirs(self.wrappers_dir)
+        self.logger.debug("Create cached directory with wrappers: {!r}".format(self.wrappers_dir))
+        os.makedirs(self.cache_dir, exist_ok=True)
 
+        # Directory is filled under another name, so other runs will never see it half-created
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        self.__fill_wrappers_dir(tmp_dir)
+
+        try:
+            os.rename(tmp_dir, self.wrappers_dir)
+        except OSError:
+            # Directory was created by another run in the meantime
+            shutil.rmtree(tmp_dir)
+
+    def __fill_wrappers_dir(self, wrappers_dir):
         paths = os.environ.get("PATH", "").split(os.pathsep)
 
         counter = 0
@@ -69,7 +122,7 @@ class Wrapper(Intercept):
                 for file in os.listdir(path):
                     if os.access(os.path.join(path, file), os.X_OK):
                         try:
-                            os.symlink(self.wrapper, os.path.join(self.wrappers_dir, file))
+                            os.symlink(self.wrapper, os.path.join(wrappers_dir, file))
                             counter += 1
                         except FileExistsError:
                             continue
@@ -112,9 +165,8 @@ class Wrapper(Intercept):
             self.logger.warning(e)
 
     def __delete_wrappers(self):
-        self.logger.debug("Delete temporary directory with wrappers: {!r}".format(self.wrappers_dir))
-
-        if os.path.exists(self.wrappers_dir):
+        if not self.cache_dir and os.path.exists(self.wrappers_dir):
+            self.logger.debug("Delete temporary directory with wrappers: {!r}".format(self.wrappers_dir))
             shutil.rmtree(self.wrappers_dir)
 
         self.logger.debug("Delete all other wrapper files")
@@ -116,3 +116,82 @@ def test_check_conf_consistency(tmpdir, cmds_file):
     c = Clade(tmpdir, cmds_file, conf=changed_conf)
     with pytest.raises(RuntimeError):
         c.parse("CC")
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_data_backend(tmpdir, cmds_file, backend):
+    test_file = os.path.abspath("tests/test_project/main.c")
+
+    c = Clade(tmpdir, cmds_file, conf={"Extension.data_backend": backend})
+    e = c.parse("SrcGraph")
+
+    db = os.path.join(e.work_dir, e.src_graph_folder, "data_by_key.db")
+    assert os.path.isfile(db) == (backend == "sqlite")
+
+    assert e.load_src_graph([test_file])[test_file]["compiled_in"]
+    assert test_file in e.load_data_by_key(e.src_graph_folder)
+    assert test_file in dict(e.yield_data_by_key(e.src_graph_folder))
+    assert not e.load_src_graph(["do_not_exist.c"])
+
+    # Data must be readable regardless of the configured backend
+    c = Clade(tmpdir, cmds_file)
+    assert c.SrcGraph.load_src_graph([test_file])[test_file]["compiled_in"]
+
+
+def test_bad_data_backend(tmpdir, cmds_file):
+    c = Clade(tmpdir, cmds_file, conf={"Extension.data_backend": "do_not_exist"})
+
+    with pytest.raises(RuntimeError):
+        c.parse("SrcGraph")
+
+
+@pytest.mark.parametrize("buffer_size", [0, 1, 10000])
+def test_data_buffer(tmpdir, cmds_file, buffer_size):
+    c = Clade(tmpdir, cmds_file, conf={"data_buffer_size": buffer_size})
+    e = c.parse("CmdGraph").extensions["Path"]
+
+    e.dump_data_by_key({"a": 1, "b": 2}, "test")
+    e.dump_data_by_key({"b": 3}, "test")
+
+    # Buffered data must be available before it is written
+    assert e.load_data_by_key("test", ["a", "b"]) == {"a": 1, "b": 3}
+    assert os.path.exists(os.path.join(e.work_dir, "test")) == (buffer_size < 3)
+
+    e.flush_data_by_key()
+    assert e.load_data_by_key("test") == {"a": 1, "b": 3}
+
+    # Paths are normalized by the CmdGraph, but must be stored by the Path
+    c = Clade(tmpdir, cmds_file)
+    assert c.Path.load_paths()
+
+
+def test_incremental_parse(tmpdir, cmds_file):
+    with open(cmds_file, "r") as fh:
+        lines = fh.readlines()
+
+    test_cmds_file = os.path.join(str(tmpdir), "cmds.txt")
+    with open(test_cmds_file, "w") as fh:
+        fh.writelines(lines[:len(lines) // 2])
+
+    c = Clade(os.path.join(str(tmpdir), "incremental"), test_cmds_file)
+    c.parse("SrcGraph")
+
+    # Emulate interception with append=True
+    with open(test_cmds_file, "a") as fh:
+        fh.writelines(lines[len(lines) // 2:])
+
+    c = Clade(os.path.join(str(tmpdir), "incremental"), test_cmds_file)
+    assert c.SrcGraph.is_outdated(test_cmds_file)
+    c.parse("SrcGraph")
+    assert not c.SrcGraph.is_outdated(test_cmds_file)
+
+    full_c = Clade(os.path.join(str(tmpdir), "full"), cmds_file)
+    full_c.parse("SrcGraph")
+
+    assert c.pid_graph == full_c.pid_graph
+    assert c.cmd_graph == full_c.cmd_graph
+    assert sorted(c.cmd_ids) == sorted(full_c.cmd_ids)
+
+    for file in full_c.src_graph:
+        for key in full_c.src_graph[file]:
+            assert set(c.src_graph[file][key]) == set(full_c.src_graph[file][key])
@@ -14,6 +14,8 @@
 # limitations under the License.
 
 from clade import Clade
+from clade.extensions.callgraph import CallEdges, merge_callgraph_parts
+from clade.extensions.utils import StringTable
 from tests.test_project import main_c, zero_c
 
 
@@ -59,3 +61,61 @@ def test_callgraph(tmpdir, cmds_file):
     callgraph_by_file_is_ok(callgraph, callgraph_by_zero_c)
     calls_by_ptr_is_ok(calls_by_ptr)
     used_in_is_ok(used_in)
+
+
+def test_callgraph_parallel(tmpdir, cmds_file):
+    conf = {"CmdGraph.requires": ["CC", "MV"], "Callgraph.parallel": True, "cpu_count": 2}
+
+    c = Clade(tmpdir, cmds_file, conf)
+    e = c.parse("Callgraph")
+
+    callgraph = e.load_callgraph()
+
+    callgraph_is_ok(callgraph)
+    callgraph_by_file_is_ok(callgraph, e.load_callgraph([zero_c]))
+
+
+def test_merge_callgraph_parts():
+    funcs = {"main": {"calls": {zero_c: {"zero": {"10": {"match_type": 4}}}}}}
+    part = {
+        "main": {
+            "calls": {zero_c: {"one": {"11": {"match_type": 4}}}},
+            "called_in": {main_c: {"main": {"12": {"match_type": 5}}}},
+        }
+    }
+
+    merge_callgraph_parts(funcs, part)
+
+    assert set(funcs["main"]["calls"][zero_c]) == {"zero", "one"}
+    assert funcs["main"]["called_in"] == part["main"]["called_in"]
+
+
+def test_string_table():
+    strings = StringTable()
+
+    s1 = "".join(["zero", ".c"])
+    s2 = "".join(["zero", ".c"])
+    assert s1 is not s2
+
+    assert strings.intern(s1) is s1
+    assert strings.intern(s2) is s1
+    assert strings.get_id(s2) == strings.get_id(s1) == 0
+    assert strings.get_str(strings.get_id("main")) == "main"
+    assert strings.intern(None) is None
+    assert len(strings) == 2 and "main" in strings
+
+
+def test_call_edges():
+    edges = CallEdges(StringTable())
+    edges.add(zero_c, "zero", main_c, "main", "10", 4)
+    edges.add(main_c, "main", main_c, "main", "12", 5, [("1", "zero")])
+
+    assert main_c in edges and zero_c in edges
+    assert "unknown" not in edges
+
+    callgraph = dict(edges.items())
+
+    assert callgraph[zero_c]["zero"]["called_in"][main_c]["main"]["10"] == {"match_type": 4}
+    assert callgraph[main_c]["main"]["calls"][zero_c]["zero"]["10"] == {"match_type": 4}
+    assert callgraph[main_c]["main"]["called_in"][main_c]["main"]["12"]["args"] == [("1", "zero")]
+    assert list(callgraph[main_c]["main"]) == ["calls", "called_in"]
@@ -16,9 +16,11 @@
 import os
 import pytest
 import re
+import shutil
 
 from clade import Clade
 from clade.extensions.opts import cc_preprocessor_opts
+from tests.test_intercept import test_project_make
 
 
 def test_cc_load_deps_by_id(tmpdir, cmds_file):
@@ -169,3 +171,116 @@ def test_cc_preprocess(tmpdir, cmds_file):
     e = c.parse("CC")
 
     assert e.get_all_pre_files()
+
+
+@pytest.mark.parametrize("use_wrappers", [True, False])
+@pytest.mark.parametrize("with_system_header_files", [True, False])
+def test_cc_intercept_deps(tmpdir, with_system_header_files, use_wrappers):
+    cmds_file = os.path.join(str(tmpdir), "cmds.txt")
+    conf = {
+        "Intercept.preprocess": True,
+        "CC.intercept_deps": True,
+        "CC.with_system_header_files": with_system_header_files,
+    }
+
+    c = Clade(os.path.join(str(tmpdir), "clade"), cmds_file, conf)
+    assert not c.intercept(command=test_project_make, use_wrappers=use_wrappers)
+    assert os.listdir(cmds_file + ".deps")
+
+    e = c.parse("CC")
+
+    conf["CC.intercept_deps"] = False
+    c = Clade(os.path.join(str(tmpdir), "clade_rerun"), cmds_file, conf)
+    e_rerun = c.parse("CC")
+
+    cmds = list(e.load_all_cmds(with_deps=True, compile_only=True))
+    assert cmds
+
+    for cmd in cmds:
+        assert set(cmd["deps"]) == set(e_rerun.load_deps_by_id(cmd["id"]))
+
+
+@pytest.mark.parametrize("append", [True, False])
+def test_cc_intercept_deps_outdated(tmpdir, append):
+    cmds_file = os.path.join(str(tmpdir), "cmds.txt")
+    conf = {"Intercept.preprocess": True, "CC.intercept_deps": True}
+
+    src_dir = os.path.join(str(tmpdir), "src")
+    os.makedirs(src_dir)
+    for header in ("a.h", "b.h"):
+        with open(os.path.join(src_dir, header), "w") as fh:
+            fh.write("int x;\n")
+
+    with open(os.path.join(src_dir, "main.c"), "w") as fh:
+        fh.write('#include "a.h"\n')
+
+    command = ["gcc", "-c", "main.c", "-o", "/dev/null"]
+    c = Clade(os.path.join(str(tmpdir), "clade1"), cmds_file, conf)
+    assert not c.intercept(command=command, cwd=src_dir, use_wrappers=True)
+    assert os.listdir(cmds_file + ".deps")
+
+    # The same command is intercepted once again without writing dependencies
+    with open(os.path.join(src_dir, "main.c"), "w") as fh:
+        fh.write('#include "b.h"\n')
+
+    c = Clade(os.path.join(str(tmpdir), "clade2"), cmds_file, dict(conf, **{"Intercept.preprocess": False}))
+    assert not c.intercept(command=command, cwd=src_dir, append=append, use_wrappers=True)
+    assert not os.path.exists(cmds_file + ".deps")
+
+    c = Clade(os.path.join(str(tmpdir), "clade3"), cmds_file, conf)
+    e = c.parse("CC")
+
+    cmds = list(e.load_all_cmds(with_deps=True, compile_only=True))
+    assert cmds
+
+    for cmd in cmds:
+        assert "b.h" in cmd["deps"]
+        assert "a.h" not in cmd["deps"]
+
+
+def test_cc_deps_cache(tmpdir, cmds_file):
+    conf = {"Compiler.deps_cache_dir": os.path.join(str(tmpdir), "cache")}
+
+    c = Clade(os.path.join(str(tmpdir), "clade1"), cmds_file, conf)
+    e = c.parse("CC")
+    cache = e.load_global_meta()["CC"]["cache"]
+    assert not cache["hits"] and cache["misses"]
+
+    c = Clade(os.path.join(str(tmpdir), "clade2"), cmds_file, conf)
+    e_cached = c.parse("CC")
+    cache_cached = e_cached.load_global_meta()["CC"]["cache"]
+
+    # Object files are removed at the end of the build, so their dependencies
+    # can't be collected, and they are not cached
+    assert cache_cached["hits"] and cache_cached["misses"] == 2
+    assert cache_cached["hits"] + cache_cached["misses"] == cache["misses"]
+
+    for cmd in e.load_all_cmds(with_deps=True):
+        assert cmd["deps"] == e_cached.load_deps_by_id(cmd["id"])
+
+
+def test_cc_deps_cache_failed(tmpdir):
+    conf = {"Compiler.deps_cache_dir": os.path.join(str(tmpdir), "cache")}
+
+    src_dir = os.path.join(str(tmpdir), "src")
+    os.makedirs(src_dir)
+
+    with open(os.path.join(src_dir, "main.c"), "w") as fh:
+        fh.write('#include "missing.h"\n')
+
+    cmds_file = os.path.join(str(tmpdir), "cmds.txt")
+    with open(cmds_file, "w") as fh:
+        fh.write("||".join([src_dir, "0", shutil.which("gcc"), "gcc", "-c", "main.c"]) + "\n")
+
+    # Dependencies of the failed command are not cached
+    c = Clade(os.path.join(str(tmpdir), "clade1"), cmds_file, conf)
+    e = c.parse("CC")
+    assert e.load_global_meta()["CC"]["cache"] == {"hits": 0, "misses": 1}
+
+    with open(os.path.join(src_dir, "missing.h"), "w") as fh:
+        fh.write("int x;\n")
+
+    c = Clade(os.path.join(str(tmpdir), "clade2"), cmds_file, conf)
+    e = c.parse("CC")
+    assert e.load_global_meta()["CC"]["cache"] == {"hits": 0, "misses": 1}
+    assert "missing.h" in e.load_deps_by_id("1")
@@ -18,6 +18,7 @@ import pytest
 import shutil
 
 from clade import Clade
+from clade.extensions.cmd_graph import CmdGraphIndex, get_transitive_closure
 
 
 def test_cmd_graph_requires(tmpdir, cmds_file):
@@ -71,3 +72,45 @@ def test_cmd_graph_empty_conf(tmpdir, cmds_file):
     e = c.parse("CmdGraph")
 
     assert e.load_cmd_graph()
+
+
+def test_cmd_graph_closure():
+    # Diamond with a cycle between "3" and "4"
+    graph = {
+        "1": {"used_by": ["2", "3"]},
+        "2": {"used_by": ["4"]},
+        "3": {"used_by": ["4"]},
+        "4": {"used_by": ["3", "5"]},
+        "5": {"used_by": []},
+    }
+
+    closure = get_transitive_closure(graph, "used_by")
+
+    assert closure["5"] == ()
+    assert closure["1"][:2] == ("2", "3")
+    assert set(closure["1"]) == {"2", "3", "4", "5"}
+    assert set(closure["2"]) == {"3", "4", "5"}
+
+
+def test_cmd_graph_index():
+    graph = {
+        "1": {"using": [], "used_by": ["3"], "type": "CC"},
+        "2": {"using": [], "used_by": ["3", "4"], "type": "CC"},
+        "3": {"using": ["1", "2"], "used_by": ["4"], "type": "LD"},
+        "4": {"using": ["2", "3"], "used_by": [], "type": "LD"},
+    }
+
+    index = CmdGraphIndex(graph)
+
+    assert set(index.get_ancestors("4")) == {"1", "2", "3"}
+    assert index.get_ancestors("4", "LD") == ["3"]
+    assert set(index.get_roots("4")) == {"1", "2"}
+    assert index.get_descendants("1") == ["3", "4"]
+    assert index.get_leaves("2") == ["4"]
+    assert index.get_descendants("4") == []
+
+    # Graph itself is not modified
+    assert graph["4"]["using"] == ["2", "3"]
+
+    with pytest.raises(RuntimeError):
+        index.get_ancestors("5")
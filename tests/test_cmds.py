@@ -17,7 +17,21 @@ import os
 import pytest
 import shutil
 
-from clade.cmds import iter_cmds, iter_cmds_by_which, open_cmds_file, get_build_dir, get_last_id, get_stats
+from clade.cmds import (
+    iter_cmds,
+    iter_cmds_by_which,
+    open_cmds_file,
+    get_build_dir,
+    get_last_id,
+    get_stats,
+    get_cmd_by_id,
+    number_of_cmds_by_which,
+    merge_spool_files,
+    convert_binary_cmds,
+    BINARY_HEADER,
+    BINARY_MAGIC,
+    CmdsIndex,
+)
 from clade.scripts.stats import print_cmds_stats
 
 # TODO: Replace >= by ==
@@ -58,3 +72,125 @@ def test_print_stats(cmds_file):
 def test_print_stats_bad():
     with pytest.raises(SystemExit):
         print_cmds_stats([])
+
+
+def test_get_cmd_by_id(cmds_file):
+    for cmd in iter_cmds(cmds_file):
+        assert get_cmd_by_id(cmds_file, cmd["id"]) == cmd
+
+    with pytest.raises(IndexError):
+        get_cmd_by_id(cmds_file, int(get_last_id(cmds_file)) + 1)
+
+
+def test_number_of_cmds_by_which(cmds_file):
+    assert number_of_cmds_by_which(cmds_file, [gcc_which]) == len(list(iter_cmds_by_which(cmds_file, [gcc_which])))
+
+
+def test_index_append(tmpdir, cmds_file):
+    test_cmds_file = os.path.join(str(tmpdir), "cmds.txt")
+    shutil.copy(cmds_file, test_cmds_file)
+
+    last_id = int(get_last_id(test_cmds_file))
+    assert os.path.exists(test_cmds_file + ".idx")
+
+    with open(cmds_file, "r") as src_fh, open(test_cmds_file, "a") as dst_fh:
+        dst_fh.write(src_fh.read())
+
+    assert int(get_last_id(test_cmds_file)) == 2 * last_id
+    assert get_cmd_by_id(test_cmds_file, 2 * last_id)["command"] == get_cmd_by_id(cmds_file, last_id)["command"]
+    assert get_stats(test_cmds_file)[gcc_which] == 2 * get_stats(cmds_file)[gcc_which]
+
+
+def test_index_replace(tmpdir, cmds_file):
+    test_cmds_file = os.path.join(str(tmpdir), "cmds.txt")
+
+    with open(test_cmds_file, "w") as fh:
+        fh.write("/cwd||0||/bin/sh||sh||build.sh\n")
+
+    assert get_last_id(test_cmds_file) == "1"
+
+    # File is replaced by a larger one, so it can't be indexed from the old size
+    shutil.copy(cmds_file, test_cmds_file + ".tmp")
+    os.replace(test_cmds_file + ".tmp", test_cmds_file)
+
+    assert get_last_id(test_cmds_file) == get_last_id(cmds_file)
+    assert get_cmd_by_id(test_cmds_file, 2) == get_cmd_by_id(cmds_file, 2)
+
+
+def test_index_replace_saved(tmpdir, cmds_file):
+    test_cmds_file = os.path.join(str(tmpdir), "cmds.txt")
+
+    with open(test_cmds_file, "w") as fh:
+        fh.write("/cwd||0||/bin/sh||sh||build.sh\n")
+
+    index = CmdsIndex(test_cmds_file)
+    index.update()
+    index.dump()
+
+    # File is overwritten in place, so its inode is not changed
+    shutil.copy(cmds_file, test_cmds_file)
+
+    index = CmdsIndex(test_cmds_file)
+    assert index.load()
+    assert index.update()
+    assert len(index) == int(get_last_id(cmds_file))
+    assert index.get_stats() == get_stats(cmds_file)
+
+
+def test_iter_after_id(cmds_file):
+    cmds = list(iter_cmds(cmds_file))
+
+    assert list(iter_cmds(cmds_file, after_id=2)) == cmds[2:]
+    assert not list(iter_cmds(cmds_file, after_id=len(cmds)))
+
+    gcc_cmds = [cmd for cmd in iter_cmds_by_which(cmds_file, [gcc_which]) if int(cmd["id"]) > 2]
+    assert list(iter_cmds_by_which(cmds_file, [gcc_which], after_id=2)) == gcc_cmds
+    assert number_of_cmds_by_which(cmds_file, [gcc_which], after_id=2) == len(gcc_cmds)
+
+
+def test_merge_spool_files(tmpdir):
+    spool_dir = os.path.join(str(tmpdir), "spool")
+    os.makedirs(spool_dir)
+    test_cmds_file = os.path.join(str(tmpdir), "cmds.txt")
+
+    with open(test_cmds_file, "w") as fh:
+        fh.write("/cwd||0||/bin/sh||sh||build.sh\n")
+
+    # Command 4 is lost, so command 5 becomes command 4
+    spool = {"100": ["2 /cwd||1||/bin/make||make\n", "5 /cwd||2||/bin/ld||ld\n"], "101": ["3 /cwd||2||/bin/cc||cc\n"]}
+    for pid, lines in spool.items():
+        with open(os.path.join(spool_dir, pid), "w") as fh:
+            fh.write("".join(lines))
+
+    with open(os.path.join(spool_dir, "102"), "w") as fh:
+        fh.write("4 /cwd||3||/bin/a")
+
+    merge_spool_files(spool_dir, test_cmds_file, last_id=1)
+
+    cmds = list(iter_cmds(test_cmds_file))
+    assert [cmd["which"] for cmd in cmds] == ["/bin/sh", "/bin/make", "/bin/cc", "/bin/ld"]
+    assert [cmd["pid"] for cmd in cmds] == ["0", "1", "2", "2"]
+
+
+def test_binary_cmds(tmpdir):
+    bin_cmds_file = os.path.join(str(tmpdir), "cmds.bin")
+    txt_cmds_file = os.path.join(str(tmpdir), "cmds.txt")
+
+    commands = [["sh", "-c", "true || false"], ["echo", "a\nb"]]
+
+    with open(bin_cmds_file, "wb") as fh:
+        for i, command in enumerate(commands):
+            data = "\0".join(["/cwd", "/bin/" + command[0]] + command).encode("utf-8") + b"\0"
+            fh.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_HEADER.size + len(data), i + 1, i, 100 + i, 0, 0))
+            fh.write(data)
+
+        # Record that is not completely written is skipped
+        fh.write(BINARY_MAGIC)
+
+    cmds = list(iter_cmds(bin_cmds_file))
+    assert [cmd["command"] for cmd in cmds] == commands
+    assert get_cmd_by_id(bin_cmds_file, 2)["pid"] == "1"
+    assert get_last_id(bin_cmds_file) == "2"
+
+    convert_binary_cmds(bin_cmds_file, txt_cmds_file)
+    assert get_cmd_by_id(txt_cmds_file, 2)["command"] == ["echo", "a\\nb"]
@@ -13,7 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import re
+
 from clade import Clade
+from clade.extensions.info import RECORD_PATTERNS, convert_to_records, get_records_file, iter_records
 
 
 def test_info(tmpdir, cmds_file):
@@ -31,3 +35,49 @@ def test_info(tmpdir, cmds_file):
     assert list(e.iter_macros_definitions())
     assert list(e.iter_macros_expansions())
     assert list(e.iter_typedefs())
+
+
+def test_info_cache(tmpdir, cmds_file):
+    conf = {"CC.filter_deps": False, "Info.cache_dir": os.path.join(str(tmpdir), "cache")}
+
+    c1 = Clade(os.path.join(str(tmpdir), "c1"), cmds_file, conf)
+    e1 = c1.parse("Info")
+    stats1 = e1.load_global_meta()["Info"]["cache"]
+    assert stats1["misses"]
+
+    c2 = Clade(os.path.join(str(tmpdir), "c2"), cmds_file, conf)
+    e2 = c2.parse("Info")
+    stats2 = e2.load_global_meta()["Info"]["cache"]
+    assert not stats2["misses"]
+    assert stats2["hits"] == stats1["hits"] + stats1["misses"]
+
+    assert sorted(e1.iter_definitions()) == sorted(e2.iter_definitions())
+    assert sorted(e1.iter_calls()) == sorted(e2.iter_calls())
+
+
+def test_info_records(tmpdir):
+    call = os.path.join(str(tmpdir), "call.txt")
+
+    with open(call, "w") as fh:
+        fh.write('"/src/main.c" main printf 10 call actual_arg_func_name1=f\n')
+        fh.write('"/src/main.c" main puts 11 call \n')
+        fh.write('"/src/zero.c" zero printf 12 call \n')
+
+    pattern = RECORD_PATTERNS["call.txt"]
+    regex = re.compile(pattern)
+
+    with open(call, "r") as fh:
+        expected = [regex.match(line).groups() for line in fh]
+
+    assert convert_to_records(call, pattern)
+    records_file = get_records_file(call)
+    assert records_file
+    assert list(iter_records(records_file)) == expected
+
+    # Records become outdated as soon as the text file is changed
+    with open(call, "a") as fh:
+        fh.write('"/src/main.c" main exit 13 call \n')
+
+    assert not get_records_file(call)
+    assert not convert_to_records(call, RECORD_PATTERNS["typedefs.txt"])
+    assert not os.path.exists(records_file)
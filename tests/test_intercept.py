@@ -15,9 +15,14 @@
 
 import os
 import shutil
+import socket
 import sys
 
+import pytest
+
+from clade.cmds import iter_cmds, get_cmd_by_id, is_binary_cmds_file, convert_binary_cmds
 from clade.intercept import intercept
+from clade.server import PreprocessServer
 
 
 test_project = os.path.join(os.path.dirname(__file__), "test_project")
@@ -55,6 +60,35 @@ def test_no_fallback_with_server(tmpdir):
         assert calculate_loc(output) > 1
 
 
+def test_no_fallback_with_spool(tmpdir):
+    output = os.path.join(str(tmpdir), "cmds.txt")
+    conf = {"Intercept.spool": True}
+
+    assert not intercept(command=test_project_make, output=output, use_wrappers=False, conf=conf)
+
+    if sys.platform != "darwin":
+        assert os.path.isfile(output)
+        assert calculate_loc(output) > 1
+
+
+def test_no_fallback_binary(tmpdir):
+    output = os.path.join(str(tmpdir), "cmds.bin")
+    txt_output = os.path.join(str(tmpdir), "cmds.txt")
+    conf = {"Intercept.binary": True}
+
+    assert not intercept(command=test_project_make, output=output, use_wrappers=False, conf=conf)
+
+    if sys.platform != "darwin":
+        assert is_binary_cmds_file(output)
+
+        cmds = list(iter_cmds(output))
+        assert len(cmds) > 1
+        assert get_cmd_by_id(output, len(cmds)) == cmds[-1]
+
+        convert_binary_cmds(output, txt_output)
+        assert list(iter_cmds(txt_output)) == cmds
+
+
 def test_fallback(tmpdir):
     output = os.path.join(str(tmpdir), "cmds.txt")
 
@@ -63,6 +97,29 @@ def test_fallback(tmpdir):
     assert calculate_loc(output) > 1
 
 
+def test_fallback_with_spool(tmpdir):
+    output = os.path.join(str(tmpdir), "cmds.txt")
+    conf = {"Intercept.spool": True}
+
+    assert not intercept(command=test_project_make, output=output, use_wrappers=True, conf=conf)
+    assert os.path.isfile(output)
+    assert calculate_loc(output) > 1
+
+
+def test_fallback_with_cached_wrappers(tmpdir):
+    output = os.path.join(str(tmpdir), "cmds.txt")
+    cache_dir = os.path.join(str(tmpdir), "cache")
+    conf = {"Wrapper.cache_dir": cache_dir}
+
+    for _ in range(2):
+        assert not intercept(command=test_project_make, output=output, use_wrappers=True, conf=conf)
+        assert os.path.isfile(output)
+        assert calculate_loc(output) > 1
+
+    # Directory with wrappers is reused by the second run
+    assert len(os.listdir(cache_dir)) == 1
+
+
 def test_fallback_with_exe_wrappers(tmpdir):
     output = os.path.join(str(tmpdir), "cmds.txt")
     cc_path = shutil.which("cc")
@@ -91,3 +148,33 @@ def test_fallback_with_unix_server(tmpdir):
     assert not intercept(command=test_project_make, output=output, use_wrappers=True, conf=conf)
     assert os.path.isfile(output)
     assert calculate_loc(output) > 1
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="UNIX sockets are used only on Linux")
+def test_server_keeps_order(tmpdir):
+    output = os.path.join(str(tmpdir), "cmds.txt")
+    conf = {"work_dir": str(tmpdir)}
+
+    server = PreprocessServer(conf, output)
+    server.start()
+
+    try:
+        clients = []
+        for _ in range(10):
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(conf["Server.address"])
+            clients.append(client)
+
+        # Commands are sent in the reverse order, but must be stored in the order of connections
+        for i, client in reversed(list(enumerate(clients))):
+            client.sendall("/cwd||0||/usr/bin/cc||cc||{}.c\n".format(i).encode("utf-8"))
+
+        for client in clients:
+            while client.recv(1024):
+                pass
+            client.close()
+    finally:
+        server.terminate()
+
+    with open(output, "r") as fh:
+        assert [line.split("||")[-1].strip() for line in fh] == ["{}.c".format(i) for i in range(10)]
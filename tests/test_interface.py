@@ -83,6 +83,9 @@ def test_cmd_graph(clade_api: Clade):
         for cmd in c.get_root_cmds_by_type(cmd_id, "CC"):
             assert cmd in root_cmds
 
+        for cmd in c.get_leaf_cmds_by_type(cmd_id, "LD"):
+            assert cmd in c.get_leaf_cmds(cmd_id)
+
         assert len(root_cmds) >= len(c.cmd_graph[cmd_id]["using"])
         assert len(c.get_leaf_cmds(cmd_id)) >= len(c.cmd_graph[cmd_id]["used_by"])
 
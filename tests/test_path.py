@@ -15,6 +15,7 @@
 
 import os
 import pathlib
+import sys
 
 from clade import Clade
 
@@ -58,3 +59,31 @@ def test_path_capital(tmpdir, cmds_file):
 
     assert "test.c" in c.Path.get_rel_path("test.c", tmpdir)
     assert "TEST.c" in c.Path.get_rel_path("TEST.c", tmpdir)
+
+
+def test_path_case_sensitive(tmpdir, cmds_file):
+    c = Clade(tmpdir, cmds_file)
+    c.parse("SrcGraph")
+
+    # Only the lower-case path is normalized and stored in the path table
+    c.Path.normalize_abs_path("/usr/src/../test.c")
+
+    # Paths that differ only in case are different files outside Windows
+    if sys.platform != "win32":
+        assert c.Path.get_abs_path("/usr/src/../TEST.c") == "/usr/src/../TEST.c"
+        assert c.Path.load_paths_by_key("/usr/src/../TEST.c") == {}
+
+
+def test_path_table(tmpdir, cmds_file):
+    c1 = Clade(tmpdir, cmds_file)
+    c1.parse("SrcGraph")
+
+    c2 = Clade(tmpdir, cmds_file)
+    assert c2.Path.load_paths()
+
+    # Paths normalized by another object must be visible as well
+    c1.Path.normalize_rel_path("../test.c", "/usr/src")
+    c1.Path.flush_data_by_key()
+
+    assert c2.Path.get_rel_path("../test.c", "/usr/src") == "/usr/test.c"
+    assert len(c2.Path.load_paths()) == len(c1.Path.paths)
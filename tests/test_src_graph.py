@@ -16,6 +16,7 @@
 import os
 
 from clade import Clade
+from clade.extensions.src_graph import SrcGraph, cmd_sets_intersect
 
 test_file = os.path.abspath("tests/test_project/main.c")
 
@@ -49,3 +50,38 @@ def test_src_graph_empty_conf(tmpdir, cmds_file):
     src_graph = e.load_src_graph()
     assert src_graph
     assert len(src_graph[test_file]["used_by"]) >= 1
+
+
+def test_src_cmd_sets(tmpdir, cmds_file):
+    c = Clade(tmpdir, cmds_file)
+    e = c.parse("SrcGraph")
+
+    src_graph = e.load_src_graph()
+
+    for key in ("compiled_in", "used_by"):
+        cmd_sets = e.load_src_cmd_sets(key)
+        assert cmd_sets == e.load_src_cmd_sets(key, src_graph)
+
+        for file1 in src_graph:
+            for file2 in src_graph:
+                common = set(src_graph[file1][key]) & set(src_graph[file2][key])
+                assert cmd_sets_intersect(cmd_sets[file1], cmd_sets[file2]) == bool(common)
+
+
+def test_src_cmd_sets_sparse(tmpdir):
+    src_graph = {
+        "dense.h": {"used_by": [str(i) for i in range(1000)]},
+        "sparse.c": {"used_by": ["999"]},
+        "other.c": {"used_by": ["1000"]},
+        "sparse.h": {"used_by": ["1000", "999"]},
+        "empty.c": {"used_by": []},
+    }
+
+    cmd_sets = SrcGraph(str(tmpdir)).load_src_cmd_sets("used_by", src_graph)
+    assert type(cmd_sets["dense.h"]) is int
+    assert type(cmd_sets["sparse.c"]) is frozenset
+
+    for file1 in src_graph:
+        for file2 in src_graph:
+            common = set(src_graph[file1]["used_by"]) & set(src_graph[file2]["used_by"])
+            assert cmd_sets_intersect(cmd_sets[file1], cmd_sets[file2]) == bool(common)
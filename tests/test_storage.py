@@ -14,10 +14,12 @@
 # limitations under the License.
 
 import os
+import pytest
 import shutil
 import unittest.mock
 
 from clade import Clade
+from clade.extensions.storage import detect_encoding
 
 test_file = os.path.abspath("tests/test_project/main.c")
 
@@ -42,3 +44,81 @@ def test_storage_with_conversion(tmpdir):
     with unittest.mock.patch("os.replace") as replace_mock:
         replace_mock.side_effect = OSError
         c.add_file_to_storage(test_file)
+
+
+def test_storage_objects(tmpdir):
+    conf = {"Storage.objects_dir": os.path.join(str(tmpdir), "objects")}
+
+    c1 = Clade(os.path.join(str(tmpdir), "clade1"), conf=conf)
+    c1.add_file_to_storage(test_file)
+    c2 = Clade(os.path.join(str(tmpdir), "clade2"), conf=conf)
+    c2.add_file_to_storage(test_file)
+
+    storage_file1 = c1.get_storage_path(test_file)
+    storage_file2 = c2.get_storage_path(test_file)
+
+    with open(storage_file2, "r") as fh1, open(test_file, "r") as fh2:
+        assert fh1.read() == fh2.read()
+
+    assert os.path.samefile(storage_file1, storage_file2)
+    assert os.stat(storage_file1).st_nlink == 3
+
+
+def test_storage_pack(tmpdir):
+    c = Clade(tmpdir)
+    c.add_file_to_storage(test_file)
+
+    with open(test_file, "rb") as fh:
+        content = fh.read()
+
+    c.Storage.pack()
+    assert not os.path.exists(c.get_storage_path(test_file))
+
+    assert c.read_storage_file(test_file, mode="rb") == content
+    with c.open_storage_file(test_file) as fh:
+        assert fh.read() == content.decode("utf-8")
+
+    with pytest.raises(FileNotFoundError):
+        c.read_storage_file("do_not_exist.c")
+
+    c.Storage.unpack()
+    assert os.path.exists(c.get_storage_path(test_file))
+    assert c.read_storage_file(test_file, mode="rb") == content
+
+
+def test_storage_pack_after_parse(tmpdir, cmds_file):
+    c = Clade(tmpdir, cmds_file, conf={"Storage.pack": True})
+    e = c.parse("CC")
+
+    assert os.path.isfile(c.Storage.pack_file)
+
+    for cmd in e.load_all_cmds(compile_only=True):
+        for cmd_in in cmd["in"]:
+            assert c.read_storage_file(os.path.join(cmd["cwd"], cmd_in))
+
+    # Storage is unpacked before parsing and packed again after it
+    c.parse("CmdGraph")
+    assert os.path.isfile(c.Storage.pack_file)
+    assert c.read_storage_file(test_file)
+
+
+def test_detect_encoding():
+    text = "int x; // Комментарий\n" * 10
+
+    assert detect_encoding(b"int x;\n") == ("ascii", 1)
+    assert detect_encoding(text.encode("utf-8")) == ("utf-8", 1)
+    assert detect_encoding(text.encode("utf-8-sig")) == ("utf-8-sig", 1)
+
+    encoding, confidence = detect_encoding(("int x;\n" * 10000 + text).encode("cp1251"))
+    assert encoding.lower() == "windows-1251" and confidence
+
+
+def test_storage_add_files_with_conversion(tmpdir):
+    c = Clade(tmpdir, conf={"Storage.convert_to_utf8": True, "cpu_count": 2})
+
+    files = [test_file, __file__, test_file]
+    c.add_files_to_storage(files)
+
+    for file in files:
+        with open(file, "rb") as fh:
+            assert c.read_storage_file(file, mode="rb") == fh.read().replace(b"\r\n", b"\n")